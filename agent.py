@@ -1,7 +1,11 @@
 from wordform import WordForm
 from wordform import cases
 from utils import predict_lemma, cloud_form
-from random import uniform, choice
+from segment import all_features, feature_type
+from buffers import FeatureBuffer
+from prototypes import CloudPrototype
+from profiling import phase
+from rng import uniform, choice
 from copy import deepcopy
 from statistics import mean
 from parameters import *
@@ -9,28 +13,109 @@ from parameters import *
 class Agent:
     """A class for simulated linguistic agents."""
     
-    def __init__(self, agent_id, initial_exemplars = None):
-        """Initialize with specified exemplars (WordForms)."""
+    def __init__(self, agent_id, initial_exemplars = None, pool = None):
+        """Initialize with specified exemplars (WordForms).
+
+        If an ExemplarPool is given, the Agent's exemplars are stored in it.
+        """
         # Set the Agent's initial set of exemplars to the set provided.  If
         # nothing was provided, set it to an empty set.
         self.agent_id = agent_id
         self.exemplars = initial_exemplars
         if initial_exemplars is None:
             self.exemplars = []
+        # Pool the values of each continuous feature across the whole cloud, so
+        # that they don't have to be collected again for every production.
+        self._feature_buffers = {f: FeatureBuffer(f,
+                                     precision = feature_precision,
+                                     resolution = fixed_point_resolution)
+                                 for f in all_features
+                                 if feature_type(f) == 'continuous'}
+        for e in self.exemplars:
+            self.quantize_exemplar(e)
+        # Keep the pool slot of each exemplar, so that it can be released when
+        # the exemplar is replaced.
+        self._pool = pool
+        self._slots = []
+        if pool is not None:
+            self._slots = [pool.intern(e) for e in self.exemplars]
+            self.exemplars = [pool[slot] for slot in self._slots]
+        for slot, e in enumerate(self.exemplars):
+            self.buffer_exemplar(slot, e)
+        # Keep running summaries (means and modes) of each cloud, so that its
+        # prototype can be read off without going through the cloud.
+        self._prototypes = dict()
+        for e in self.exemplars:
+            self.prototype(e.lemma, e.case).add(e)
+        # The random streams that entrenchment targets are worked out with
+        # when there are several threads (see `entrenchment_threads`), spawned
+        # as they're first needed and reused for every production.
+        self._entrenchment_streams = []
+    
+    def buffer_exemplar(self, slot, exemplar):
+        """Record the exemplar's feature values in the Agent's buffers."""
+        for feat in self._feature_buffers:
+            values = [s.features[feat]
+                      for p, s in enumerate(exemplar.segments)
+                      if p < 3 and feat in s.features]
+            self._feature_buffers[feat].set_slot(slot, values)
+    
+    def quantize_exemplar(self, exemplar):
+        """Round the exemplar's values to the precision they're stored in."""
+        if feature_precision != 'double':
+            for s in exemplar.segments:
+                for feat, buffer in self._feature_buffers.items():
+                    if feat in s.features:
+                        s.features[feat] = buffer.quantize(s.features[feat])
     
     def add_exemplar(self, new_exemplar):
         """Add a single exemplar to the Agent's cloud."""
-        # If the Agent's cloud is already at the maximum size, randomly replace
-        # an existing exemplar.
-        target_cloud = [e for e in self.exemplars
+        self.quantize_exemplar(new_exemplar)
+        # Find the positions of the new exemplar's cloud.  (Positions rather
+        # than exemplars, since a pooled exemplar can appear more than once.)
+        target_slots = [slot for slot, e in enumerate(self.exemplars)
                         if e.lemma == new_exemplar.lemma
                            and e.case == new_exemplar.case]
-        if len(target_cloud) == max_cloud_size:
-            old_exemplar = choice(target_cloud)
-            self.exemplars[self.exemplars.index(old_exemplar)] = new_exemplar
+        # If the exemplars are pooled, store the new one in the pool (or share
+        # an identical one that's already there).
+        if self._pool is not None:
+            pool_slot = self._pool.intern(new_exemplar)
+            new_exemplar = self._pool[pool_slot]
+        # If the Agent's cloud is already at the maximum size, randomly replace
+        # an existing exemplar.
+        if len(target_slots) == max_cloud_size:
+            slot = choice(target_slots)
+            self.prototype(new_exemplar.lemma, new_exemplar.case).\
+                remove(self.exemplars[slot])
+            self.exemplars[slot] = new_exemplar
+            if self._pool is not None:
+                self._pool.release(self._slots[slot])
+                self._slots[slot] = pool_slot
         # Otherwise, just add the new exemplar.
         else:
+            slot = len(self.exemplars)
             self.exemplars.append(new_exemplar)
+            if self._pool is not None:
+                self._slots.append(pool_slot)
+        # Update the pooled feature values and the cloud's summaries in place.
+        self.buffer_exemplar(slot, new_exemplar)
+        self.prototype(new_exemplar.lemma, new_exemplar.case).add(new_exemplar)
+    
+    def prototype(self, lemma, case):
+        """Return the running summaries of the cloud of a lemma and case."""
+        if not (lemma, case) in self._prototypes:
+            self._prototypes[(lemma, case)] = CloudPrototype()
+        return self._prototypes[(lemma, case)]
+    
+    def cloud_summaries(self):
+        """Return the mean or modes of each feature in each cloud.
+
+        The result maps (lemma, case) to a dictionary from (position, feature)
+        to the mean of a continuous feature or the modes of a categorical one.
+        """
+        return {key: self._prototypes[key].summary()
+                for key in sorted(self._prototypes)
+                if len(self._prototypes[key]) > 0}
     
     def add_exemplars(self, new_exemplars):
         """Add several new exemplars to the Agent's cloud."""
@@ -64,9 +149,7 @@ class Agent:
             # Print one example in each cell of the lemma's paradigm.
             for case in cases:
                 case_name = cases[case]['name']
-                forms = [e for e in self.exemplars
-                         if e.lemma == l and e.case == case]
-                form = cloud_form(forms)
+                form = cloud_form(prototype = self.prototype(l, case))
                 print(col_spacer + '{:<{width}}'.format(form,
                                                         width = len(case_name)),
                       end = '')
@@ -76,41 +159,99 @@ class Agent:
     def produce(self, paradigms, bias, informativity, categorization,
                 unique_base):
         """Return a WordForm based on a random WordForm in the Agent's cloud."""
-        # Choose a random lemma and case to produce.
-        lemma = choice(list(self.get_lemmas()))
-        case = choice(list(cases.keys()))
-        # Choose a random exemplar to serve as the base of production.
-        cloud = [e for e in self.exemplars
-                 if e.lemma == lemma and e.case == case]
-        production = deepcopy(choice(cloud))
+        production = self.select_exemplar()
         # Apply entrenchment between the production and the Agent's cloud.
         production.entrench(self.exemplars, paradigms, informativity,
-                            categorization, unique_base)
+                            categorization, unique_base,
+                            buffers = self._feature_buffers,
+                            streams = self._entrenchment_streams)
         # Add noise and bias to the production.
-        production.add_bias(bias)
-        production.add_noise()
+        with phase('bias'):
+            production.add_bias(bias)
+        with phase('noise'):
+            production.add_noise()
         return production
     
+    def select_exemplar(self):
+        """Return a copy of a random exemplar to serve as a production."""
+        with phase('selection'):
+            # Choose a random lemma and case to produce.
+            lemma = choice(list(self.get_lemmas()))
+            case = choice(list(cases.keys()))
+            # Choose a random exemplar to serve as the base of production.
+            cloud = [e for e in self.exemplars
+                     if e.lemma == lemma and e.case == case]
+            return deepcopy(choice(cloud))
+    
+    def produce_round(self, k, paradigms, bias, informativity, categorization,
+                      unique_base):
+        """Return k WordForms produced from a frozen snapshot of the cloud."""
+        # Entrenchment targets (KDE maxima and paradigm weights) depend only on
+        # the cloud, so compute each one once and share it among all the
+        # productions in the round.
+        cache = dict()
+        productions = []
+        for i in range(k):
+            production = self.select_exemplar()
+            production.entrench(self.exemplars, paradigms, informativity,
+                                categorization, unique_base,
+                                buffers = self._feature_buffers, cache = cache,
+                                streams = self._entrenchment_streams)
+            productions.append(production)
+        # Add noise and bias to all the productions.
+        with phase('bias'):
+            for production in productions:
+                production.add_bias(bias)
+        with phase('noise'):
+            for production in productions:
+                production.add_noise()
+        return productions
+    
     def categorize(self, wordform, prob_esp, categorization):
         """Return the lemma to which the WordForm most likely belongs."""
         # With the probability specified in the argument, use ESP to determine
         # the category of the WordForm provided.
-        if uniform(0, 1) < prob_esp:
-            return wordform.lemma
-        # Otherwise, guess intelligently.
-        else:
-            return predict_lemma(wordform, self.exemplars,
-                                 method = categorization)
+        with phase('categorization'):
+            if uniform(0, 1) < prob_esp:
+                return wordform.lemma
+            # Otherwise, guess intelligently.
+            else:
+                return predict_lemma(wordform, self.exemplars,
+                                     method = categorization)
     
     def store(self, wordform, prob_esp, categorization):
         """Store the WordForm in the Agent's exemplar cloud."""
-        # Make a copy of the exemplar to store.
-        new_ex = deepcopy(wordform)
-        # Categorize it and set its lemma appropriately.
-        new_ex.lemma = self.categorize(new_ex, prob_esp = prob_esp,
-                                       categorization = categorization)
+        # Categorize the WordForm and store a version of it with its lemma set
+        # appropriately.
+        lemma = self.categorize(wordform, prob_esp = prob_esp,
+                                categorization = categorization)
+        new_ex = self.relabelled(wordform, lemma)
         # Add it to the cloud.
-        self.add_exemplar(new_ex)
+        with phase('storage'):
+            self.add_exemplar(new_ex)
+    
+    def store_round(self, wordforms, prob_esp, categorization):
+        """Store several WordForms, all categorized against the same cloud."""
+        # Categorize every WordForm before storing any of them, so that none of
+        # the round's WordForms influences the categorization of another.
+        lemmas = [self.categorize(wf, prob_esp = prob_esp,
+                                  categorization = categorization)
+                  for wf in wordforms]
+        new_exs = [self.relabelled(wf, lemma)
+                   for wf, lemma in zip(wordforms, lemmas)]
+        # Add them to the cloud.
+        with phase('storage'):
+            self.add_exemplars(new_exs)
+    
+    def relabelled(self, wordform, lemma):
+        """Return a copy of the WordForm to store, with the lemma given."""
+        # Pooled exemplars are never changed in place, so let the pool make
+        # the copy.
+        if self._pool is not None:
+            return self._pool.relabel(wordform, lemma)
+        new_ex = deepcopy(wordform)
+        new_ex.lemma = lemma
+        return new_ex
     
     def __repr__(self):
         return 'Agent(' + str(self.agent_id) + ', ' + repr(self.exemplars) + ')'
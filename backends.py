@@ -0,0 +1,58 @@
+"""Load the heavy libraries the simulation depends on only when they're needed.
+
+Kernel density estimation (pyqt_fit) is used for entrenchment, and naive Bayes
+classification (NaiveBayes) for categorization with `categorization_setting =
+'bayes'`.  Neither is imported until the first time it's used, so that short
+runs and worker processes that never need one don't pay for loading it.
+"""
+
+from collections import Counter
+from importlib import import_module
+
+# For each backend: the module that provides it and, if the backend is an
+# object within the module rather than the module itself, the object's name.
+backend_sources = {'kde': ('pyqt_fit.kde', None),
+                   'naive_bayes': ('NaiveBayes', 'NaiveBayes')}
+
+_loaded = dict()
+# How many times each backend has been used since the last reset.
+usage = Counter()
+
+def get_backend(name):
+    """Return the backend with the name given, loading it if necessary."""
+    if not name in backend_sources:
+        raise BackendNotFoundError(name)
+    if not name in _loaded:
+        module_name, attribute = backend_sources[name]
+        try:
+            module = import_module(module_name)
+        except ImportError as error:
+            raise BackendNotAvailableError(name + ' (' + str(error) + ')')
+        _loaded[name] = module if attribute is None \
+                        else getattr(module, attribute)
+    usage[name] += 1
+    return _loaded[name]
+
+def backends_used():
+    """Return the names of the backends used since the last reset."""
+    return sorted(usage)
+
+def backends_loaded():
+    """Return the names of the backends loaded by this process."""
+    return sorted(_loaded)
+
+def reset_usage():
+    """Forget which backends have been used."""
+    usage.clear()
+
+class BackendError(Exception):
+    """Exception raised when a backend can't be provided."""
+    pass
+
+class BackendNotFoundError(BackendError):
+    """Exception raised when a backend isn't defined."""
+    pass
+
+class BackendNotAvailableError(BackendError):
+    """Exception raised when a backend's library can't be imported."""
+    pass
@@ -0,0 +1,229 @@
+"""Time the simulation's hot paths and record the results in a JSON file.
+
+Usage:
+    python benchmarks.py [--full] [--only NAME ...] [--output FILE]
+                         [--compare OLD_FILE] [--tolerance PROPORTION]
+
+Every benchmark is run for each combination of cloud size, number of lemmas,
+and informativity setting (and, where it matters, categorization setting).
+Results for the same benchmark and settings in two files can be compared to
+look for regressions between versions of the code.
+"""
+
+import argparse, datetime, itertools, json, os, platform, subprocess
+import shutil, tempfile
+from copy import deepcopy
+from statistics import mean, median, pstdev
+from time import perf_counter
+import log_utils
+import parameters
+import rng
+from agent import Agent
+from log_utils import log_state
+from segment import density_maxima
+from simulation import configure, initialize_agent, run_simulation
+from utils import entropy, performance, predict_lemma
+
+# The settings each benchmark is run with.  The quick grid is the default; the
+# full grid is used with --full.
+quick_grid = {'max_cloud_size': [13, 26],
+              'num_lemmas': [2, 4],
+              'informativity_setting': ['classification', 'none']}
+full_grid = {'max_cloud_size': [13, 26, 52],
+             'num_lemmas': [2, 4, 8],
+             'informativity_setting': ['classification', 'entropy', 'none']}
+categorization_settings = ['similarity', 'bayes']
+# How many times is each benchmark repeated?
+repeats = 5
+# How many iterations of the simulation are timed by the full-run benchmark?
+run_iterations = 20
+
+def new_agent(agent_id = 1):
+    """Return an Agent seeded with the current settings' initial exemplars."""
+    agent = Agent(agent_id)
+    initialize_agent(agent)
+    return agent
+
+def production_settings(categorization):
+    """Return the keyword arguments for Agent.produce()."""
+    return {'paradigms': True,
+            'bias': {'final': True, 'medial': False},
+            'informativity': parameters.informativity_setting,
+            'categorization': categorization,
+            'unique_base': True}
+
+def bench_density_maxima(agent, categorization):
+    """Time the KDE over every VOT value in the cloud."""
+    values = agent._feature_buffers['vot'].weighted_values()
+    return lambda: density_maxima('vot', values)
+
+def bench_entrench_feature(agent, categorization):
+    """Time entrenching a VOT value towards the whole cloud."""
+    values = agent._feature_buffers['vot'].weighted_values()
+    segment = deepcopy(agent.exemplars[0].segments[2])
+    return lambda: segment.entrench_feature('vot', values, top_value = False,
+                                            max_movement = 100)
+
+def bench_predict_lemma(agent, categorization):
+    """Time categorizing one exemplar against the rest."""
+    wordform = agent.exemplars[0]
+    return lambda: predict_lemma(wordform, agent.exemplars[1:],
+                                 method = categorization)
+
+def bench_performance(agent, categorization):
+    """Time leave-one-out classification of one case."""
+    cloud = [e for e in agent.exemplars if e.case == 'abs']
+    return lambda: performance(cloud, positions = [2], features = ['vot'],
+                               method = categorization)
+
+def bench_entropy(agent, categorization):
+    """Time the entropy of final VOT values across the cloud."""
+    values = [e.segments[2].features['vot'] for e in agent.exemplars]
+    return lambda: entropy('vot', values)
+
+def bench_add_exemplar(agent, categorization):
+    """Time storing an exemplar in a full cloud."""
+    exemplars = [deepcopy(e) for e in agent.exemplars]
+    exemplar_cycle = itertools.cycle(exemplars)
+    return lambda: agent.add_exemplar(next(exemplar_cycle))
+
+def bench_produce(agent, categorization):
+    """Time a production, including entrenchment."""
+    settings = production_settings(categorization)
+    return lambda: agent.produce(**settings)
+
+def bench_store(agent, categorization):
+    """Time categorizing and storing a production."""
+    productions = itertools.cycle([deepcopy(e) for e in agent.exemplars])
+    return lambda: agent.store(next(productions), prob_esp = .2,
+                               categorization = categorization)
+
+def bench_log_state(agent, categorization):
+    """Time writing the Agent to the log."""
+    return lambda: log_state(agent)
+
+def bench_run(agent, categorization):
+    """Time a short run of the whole simulation."""
+    def run():
+        configure(iterations = run_iterations,
+                  categorization_setting = categorization)
+        run_simulation(quiet = True)
+    return run
+
+# For each benchmark: the function that sets it up, and whether its timing
+# depends on the categorization setting.
+benchmarks = {'density_maxima': (bench_density_maxima, False),
+              'entrench_feature': (bench_entrench_feature, False),
+              'predict_lemma': (bench_predict_lemma, True),
+              'performance': (bench_performance, True),
+              'entropy': (bench_entropy, False),
+              'add_exemplar': (bench_add_exemplar, False),
+              'produce': (bench_produce, True),
+              'store': (bench_store, True),
+              'log_state': (bench_log_state, False),
+              'run': (bench_run, True)}
+
+def time_calls(call, repeats):
+    """Return summary statistics for the time taken by repeated calls."""
+    times = []
+    for i in range(repeats):
+        start = perf_counter()
+        call()
+        times.append(perf_counter() - start)
+    return {'min': min(times), 'median': median(times), 'mean': mean(times),
+            'sd': pstdev(times), 'repeats': repeats}
+
+def run_benchmarks(grid, names, repeats = repeats):
+    """Run the named benchmarks over the grid of settings."""
+    results = []
+    setting_names = sorted(grid)
+    for setting_values in itertools.product(*[grid[n] for n in setting_names]):
+        settings = dict(zip(setting_names, setting_values))
+        for name in names:
+            setup, uses_categorization = benchmarks[name]
+            categorizations = ['similarity']
+            if uses_categorization:
+                categorizations = categorization_settings
+            for categorization in categorizations:
+                # Start every benchmark from the same initial state.
+                configure(**settings)
+                rng.seed(0)
+                agent = new_agent()
+                stats = time_calls(setup(agent, categorization), repeats)
+                params = dict(settings, categorization_setting = categorization)
+                results.append({'name': name, 'params': params,
+                                'seconds': stats})
+                print('{:<18}{:<70}{:>12.6f}'.format(name,
+                                                     json.dumps(params),
+                                                     stats['median']))
+    return results
+
+def code_version():
+    """Return the git commit of the code being benchmarked, if there is one."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output = True, text = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__)))\
+                         .stdout.strip() or None
+    except OSError:
+        return None
+
+def result_key(result):
+    """Return a key identifying a benchmark and its settings."""
+    return (result['name'], json.dumps(result['params'], sort_keys = True))
+
+def compare(old_results, new_results, tolerance):
+    """Print the change in median time for each benchmark in both files."""
+    old = {result_key(r): r for r in old_results}
+    regressions = 0
+    for result in new_results:
+        key = result_key(result)
+        if key in old:
+            ratio = result['seconds']['median'] / \
+                    old[key]['seconds']['median']
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = 'SLOWER'
+                regressions += 1
+            elif ratio < 1 - tolerance:
+                flag = 'faster'
+            print('{:<18}{:<70}{:>8.2f}x {}'.format(key[0], key[1], ratio,
+                                                    flag))
+    return regressions
+
+def main():
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description = 'Benchmark the simulation.')
+    parser.add_argument('--full', action = 'store_true',
+                        help = 'use the full grid of settings')
+    parser.add_argument('--only', nargs = '+', choices = sorted(benchmarks),
+                        help = 'run only these benchmarks')
+    parser.add_argument('--repeats', type = int, default = repeats)
+    parser.add_argument('--output', default = 'bench_results.json')
+    parser.add_argument('--compare', help = 'earlier results to compare with')
+    parser.add_argument('--tolerance', type = float, default = .1,
+                        help = 'proportional slowdown counted as a regression')
+    args = parser.parse_args()
+    # Keep the logs written by the benchmarks out of the way.
+    log_dir = tempfile.mkdtemp()
+    log_utils.log_file_name = os.path.join(log_dir, 'bench.json')
+    grid = full_grid if args.full else quick_grid
+    names = args.only or list(benchmarks)
+    results = run_benchmarks(grid, names, args.repeats)
+    output = {'code_version': code_version(),
+              'timestamp': datetime.datetime.now().isoformat(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'results': results}
+    with open(args.output, 'w') as out_file:
+        json.dump(output, out_file, indent = 1)
+    shutil.rmtree(log_dir, ignore_errors = True)
+    if args.compare:
+        with open(args.compare) as old_file:
+            old_results = json.load(old_file)['results']
+        print()
+        if compare(old_results, results, args.tolerance) > 0:
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+from segment import WeightedValues, feature_range
+from numpy import empty, ones, float32, int16, iinfo
+
+# The type in which values are stored with each precision.  'fixed' stores
+# whole multiples of a resolution (such as .1) as 16-bit integers.
+precision_types = {'double': float, 'single': float32, 'fixed': int16}
+
+class FeatureBuffer:
+    """A pooled array of the values of one feature across an Agent's cloud."""
+
+    def __init__(self, feature, capacity = 64, precision = 'double',
+                 resolution = .1):
+        """Initialize an empty buffer for the feature provided.
+
+        Values are stored in double or single precision, or in fixed point at
+        the resolution given.
+        """
+        if not precision in precision_types:
+            raise PrecisionNotDefinedError(precision)
+        self.feature = feature
+        self.precision = precision
+        self.resolution = resolution
+        self.dtype = precision_types[precision]
+        # Make sure every value in the feature's range fits in fixed point.
+        if precision == 'fixed' and \
+           max(abs(v) for v in feature_range(feature)) / resolution > \
+           iinfo(int16).max:
+            raise ResolutionTooFineError(feature, resolution)
+        # The values of the feature, one entry per Segment that has it.
+        self.values = empty(capacity, dtype = self.dtype)
+        # The slot (index in the Agent's list of exemplars) that each entry
+        # belongs to.
+        self.owners = empty(capacity, dtype = 'int32')
+        # Every entry has a weight of 1; keep an array of ones around so that
+        # it doesn't have to be rebuilt for every production.
+        self.weights = ones(capacity, dtype = self.weight_type())
+        self.size = 0
+        # For each slot, the indices of its entries in the buffer.
+        self.slot_entries = dict()
+
+    def grow(self, needed):
+        """Make sure the buffer has room for the number of entries given."""
+        capacity = len(self.values)
+        if needed > capacity:
+            while capacity < needed:
+                capacity *= 2
+            values = empty(capacity, dtype = self.dtype)
+            values[:self.size] = self.values[:self.size]
+            owners = empty(capacity, dtype = 'int32')
+            owners[:self.size] = self.owners[:self.size]
+            self.values = values
+            self.owners = owners
+            self.weights = ones(capacity, dtype = self.weight_type())
+
+    def remove_slot(self, slot):
+        """Remove all entries belonging to the slot provided."""
+        # Fill each hole with the last entry in the buffer, so that the
+        # occupied entries stay contiguous.
+        for index in sorted(self.slot_entries.pop(slot, []), reverse = True):
+            last = self.size - 1
+            if index != last:
+                moved_slot = self.owners[last]
+                self.values[index] = self.values[last]
+                self.owners[index] = moved_slot
+                entries = self.slot_entries[moved_slot]
+                entries[entries.index(last)] = index
+            self.size -= 1
+
+    def weight_type(self):
+        """Return the type in which weights are stored."""
+        # Weights (all 1) lose nothing in single precision.
+        return float if self.precision == 'double' else float32
+
+    def quantize(self, value):
+        """Return the value as it would be stored in the buffer."""
+        if self.precision == 'single':
+            return float(float32(value))
+        if self.precision == 'fixed':
+            return round(value / self.resolution) * self.resolution
+        return value
+
+    def encode(self, value):
+        """Return the stored form of a value."""
+        if self.precision == 'fixed':
+            return round(value / self.resolution)
+        return value
+
+    def set_slot(self, slot, values):
+        """Store the values of the feature for the exemplar in the slot."""
+        values = [self.encode(v) for v in values]
+        entries = self.slot_entries.get(slot)
+        # If the slot already has the right number of entries, overwrite them
+        # in place.
+        if entries is not None and len(entries) == len(values):
+            for index, value in zip(entries, values):
+                self.values[index] = value
+        # Otherwise, drop the old entries and append new ones.
+        else:
+            self.remove_slot(slot)
+            self.grow(self.size + len(values))
+            entries = list(range(self.size, self.size + len(values)))
+            for index, value in zip(entries, values):
+                self.values[index] = value
+                self.owners[index] = slot
+            self.size += len(values)
+            self.slot_entries[slot] = entries
+
+    def weighted_values(self):
+        """Return the current values of the feature, each with weight 1."""
+        values = self.values[:self.size]
+        # Fixed-point values have to be scaled back into the feature's units.
+        if self.precision == 'fixed':
+            values = values * self.resolution
+        return WeightedValues(values, self.weights[:self.size])
+
+    def __len__(self):
+        """Return the number of values in the buffer."""
+        return self.size
+
+class PrecisionNotDefinedError(Exception):
+    """Exception raised when a precision isn't one of `precision_types`."""
+    pass
+
+class ResolutionTooFineError(Exception):
+    """Exception raised when a feature's range doesn't fit in fixed point."""
+    pass
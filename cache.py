@@ -0,0 +1,220 @@
+"""Cache the results of simulation runs, keyed by their full configuration.
+
+Usage:
+    python cache.py [--set NAME=VALUE ...] [--trajectory]
+    python cache.py --stats
+    python cache.py --clear
+
+A run is identified by a hash of every setting in `parameters.py`, the shape of
+the lexicon, the seed, and the source code of the simulation.  Running a
+configuration that is already in the cache returns the stored result at once.
+Only runs with a fixed `random_seed` are cached, since other runs can't be
+reproduced.  When the cache grows past `cache_max_bytes`, the least recently
+used results are evicted.
+"""
+
+import argparse, gzip, hashlib, json, os, shutil, tempfile
+from time import perf_counter, time
+import log_utils
+import parameters
+from catalogue import effective_parameters
+from outcomes import devoicing_outcome
+from segment import all_features, all_segments
+from simulation import configured, parse_setting, run_simulation, run_info
+from wordform import cases
+
+# Settings that only affect how a run is reported, not what happens in it.
+reporting_settings = {'verbose_setting', 'logging_setting', 'telemetry_output',
+                      'telemetry_interval', 'profiling_setting',
+                      'profile_window', 'profile_file', 'cache_directory',
+                      'cache_max_bytes', 'catalogue_file'}
+
+def lexicon_spec():
+    """Return a description of the lexicon the agents start out with."""
+    return {'num_lemmas': parameters.num_lemmas,
+            'lemma_shapes': ['CVC'] * parameters.num_lemmas,
+            'cases': cases,
+            'features': {f: dict(all_features[f],
+                                 values = sorted(all_features[f]['values']))
+                         for f in all_features},
+            'segments': all_segments}
+
+def code_version():
+    """Return a hash of the simulation's source code."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for file_name in sorted(os.listdir(here)):
+        if file_name.endswith('.py'):
+            digest.update(file_name.encode())
+            with open(os.path.join(here, file_name), 'rb') as source:
+                digest.update(source.read())
+    return digest.hexdigest()
+
+def effective_config():
+    """Return everything that determines the outcome of a run."""
+    settings = effective_parameters()
+    return {'parameters': {name: settings[name] for name in sorted(settings)
+                           if not name in reporting_settings},
+            'lexicon': lexicon_spec(),
+            'seed': settings['random_seed'],
+            'code_version': code_version()}
+
+def config_key(config):
+    """Return the hash that identifies a configuration."""
+    canonical = json.dumps(config, sort_keys = True, default = repr)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class ResultCache:
+    """A size-bounded, least-recently-used store of run results on disk."""
+
+    def __init__(self, directory = None, max_bytes = None):
+        self.directory = directory or parameters.cache_directory
+        self.max_bytes = max_bytes or parameters.cache_max_bytes
+        os.makedirs(self.directory, exist_ok = True)
+
+    def entry_dir(self, key):
+        """Return the directory that holds a cached result."""
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, trajectory = False):
+        """Return the cached result for the key, or None if there isn't one.
+
+        If a trajectory is requested, only a result stored with one counts.
+        """
+        summary_file = os.path.join(self.entry_dir(key), 'summary.json')
+        trajectory_file = os.path.join(self.entry_dir(key),
+                                       'trajectory.json.gz')
+        try:
+            with open(summary_file) as summary_in:
+                result = json.load(summary_in)
+        except (OSError, ValueError):
+            return None
+        if trajectory:
+            if not os.path.exists(trajectory_file):
+                return None
+            result['trajectory_file'] = trajectory_file
+        # Mark the entry as recently used.
+        os.utime(self.entry_dir(key))
+        return result
+
+    def put(self, key, result, trajectory_file = None):
+        """Store a result (and optionally the log of its trajectory)."""
+        # Assemble the entry in a temporary directory and move it into place,
+        # so that readers never see a partial entry.
+        os.makedirs(os.path.dirname(self.entry_dir(key)), exist_ok = True)
+        temp_dir = tempfile.mkdtemp(dir = self.directory)
+        with open(os.path.join(temp_dir, 'summary.json'), 'w') as summary_out:
+            json.dump(result, summary_out, indent = 1, default = repr)
+        if trajectory_file is not None:
+            with open(trajectory_file, 'rb') as log_in, \
+                 gzip.open(os.path.join(temp_dir, 'trajectory.json.gz'),
+                           'wb') as trajectory_out:
+                shutil.copyfileobj(log_in, trajectory_out)
+        shutil.rmtree(self.entry_dir(key), ignore_errors = True)
+        os.replace(temp_dir, self.entry_dir(key))
+        self.evict()
+
+    def entries(self):
+        """Return (last used, size, directory) for every cached result."""
+        entries = []
+        for prefix in os.listdir(self.directory):
+            prefix_dir = os.path.join(self.directory, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, key)
+                size = sum(os.path.getsize(os.path.join(entry_dir, f))
+                           for f in os.listdir(entry_dir))
+                entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used results until the cache fits."""
+        entries = sorted(self.entries())
+        total = sum(size for used, size, entry_dir in entries)
+        for used, size, entry_dir in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors = True)
+            total -= size
+
+    def clear(self):
+        """Remove every cached result."""
+        for used, size, entry_dir in self.entries():
+            shutil.rmtree(entry_dir, ignore_errors = True)
+
+def cached_run(settings = None, trajectory = False, cache = None):
+    """Run the simulation with the settings given, unless it's been run before.
+
+    Return the run's summary (and, if requested, the name of a gzipped copy of
+    its log).  The settings are only overridden for this run.
+    """
+    old_log_file = log_utils.log_file_name
+    log_dir = None
+    try:
+        with configured(**(settings or {})):
+            config = effective_config()
+            key = config_key(config)
+            if cache is None:
+                cache = ResultCache()
+            reproducible = config['seed'] is not None
+            if reproducible:
+                result = cache.get(key, trajectory)
+                if result is not None:
+                    result['cached'] = True
+                    return result
+            # Run the simulation, logging to a temporary file if the trajectory
+            # is to be kept.
+            log_dir = tempfile.mkdtemp()
+            log_utils.log_file_name = os.path.join(log_dir, 'trajectory.json')
+            with configured(logging_setting = trajectory):
+                start = perf_counter()
+                a1, a2 = run_simulation(quiet = True)
+                seconds = perf_counter() - start
+            result = {'key': key, 'config': config, 'created': time(),
+                      'seconds': seconds, 'run_info': dict(run_info),
+                      'outcome': devoicing_outcome([a1, a2])}
+            if reproducible:
+                cache.put(key, dict(result),
+                          log_utils.log_file_name if trajectory else None)
+                # Point to the cached copy of the log, unless the new entry was
+                # evicted straight away (if it's larger than the cache, say).
+                if trajectory:
+                    trajectory_file = os.path.join(cache.entry_dir(key),
+                                                   'trajectory.json.gz')
+                    result['trajectory_file'] = trajectory_file \
+                        if os.path.exists(trajectory_file) else None
+    finally:
+        log_utils.log_file_name = old_log_file
+        if log_dir is not None:
+            shutil.rmtree(log_dir, ignore_errors = True)
+    result['cached'] = False
+    return result
+
+def main():
+    """Run a cached simulation, or manage the cache, from the command line."""
+    parser = argparse.ArgumentParser(description = 'Run the simulation ' +
+                                     'through the result cache.')
+    parser.add_argument('--set', action = 'append', default = [],
+                        help = 'override a setting (NAME=VALUE)')
+    parser.add_argument('--trajectory', action = 'store_true',
+                        help = 'keep the log of the run as well')
+    parser.add_argument('--stats', action = 'store_true')
+    parser.add_argument('--clear', action = 'store_true')
+    args = parser.parse_args()
+    cache = ResultCache()
+    if args.clear:
+        cache.clear()
+    elif args.stats:
+        entries = cache.entries()
+        print('{} results, {:.1f} MB (limit {:.1f} MB)'.format(len(entries),
+              sum(size for used, size, d in entries) / 2 ** 20,
+              cache.max_bytes / 2 ** 20))
+    else:
+        result = cached_run(dict(parse_setting(s) for s in args.set),
+                            args.trajectory, cache)
+        print(json.dumps({k: result[k] for k in result if k != 'config'},
+                         indent = 1, default = repr))
+
+if __name__ == '__main__':
+    main()
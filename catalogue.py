@@ -0,0 +1,400 @@
+"""An index of completed runs, kept in an SQLite database.
+
+Usage:
+    python catalogue.py add LOG_OR_META ... [--catalogue FILE]
+    python catalogue.py query [QUERY] [--show NAME ...] [--order NAME]
+                              [--descending] [--limit N] [--catalogue FILE]
+
+With `catalogue_file` set in `parameters.py`, runs add themselves to the
+catalogue as they finish: their full set of parameters, their seed, how long
+they took, and their outcome (the median VOT at the end of the stem in each
+agent's clouds, and whether final devoicing emerged; see
+`outcomes.devoicing_outcome()`).  Runs that keep a log also write this
+description next to the log (`sim_raw_*.meta`), and `add` puts such
+descriptions in another catalogue (for example, one that collects the runs of
+several machines).
+
+Queries are conditions on the parameters and outcomes of runs, joined with
+`and`, `or`, and `not`, for example:
+
+    python catalogue.py query "paradigm_weight > .3 and devoiced"
+    python catalogue.py query "vot_abs_1 > 40 and round_size = 1" --show seed
+
+Besides settings from `parameters.py`, conditions can use `seed`, `seconds`,
+`iterations_run`, `iterations_per_second`, `stop_reason`, `score`, `devoiced`,
+`log_file`, and `vot_CASE_LEMMA` (the median VOT of either agent's cloud, such
+as `vot_abs_1`).
+"""
+
+import argparse, json, os, re, sqlite3, sys, types
+from time import time
+import parameters
+from outcomes import devoicing_outcome
+
+# Where the catalogue is kept, unless `catalogue_file` says otherwise.
+default_catalogue = 'sim_catalogue.sqlite'
+
+# Parameters are stored as (run, name, value) rows, indexed by name and value,
+# so that a condition on any parameter is a single index lookup.  Outcomes
+# that are conditioned on often are indexed too.
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    log_file TEXT UNIQUE,
+    recorded REAL,
+    seed TEXT,
+    seconds REAL,
+    iterations_run INTEGER,
+    iterations_per_second REAL,
+    stop_reason TEXT,
+    score REAL,
+    devoiced INTEGER
+);
+CREATE TABLE IF NOT EXISTS parameters (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    value
+);
+CREATE TABLE IF NOT EXISTS medians (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    agent INTEGER,
+    lemma INTEGER,
+    case_name TEXT,
+    vot_median REAL
+);
+CREATE INDEX IF NOT EXISTS parameters_by_value
+    ON parameters (name, value, run_id);
+CREATE INDEX IF NOT EXISTS parameters_by_run ON parameters (run_id);
+CREATE INDEX IF NOT EXISTS medians_by_value
+    ON medians (lemma, case_name, vot_median, run_id);
+CREATE INDEX IF NOT EXISTS medians_by_run ON medians (run_id);
+CREATE INDEX IF NOT EXISTS runs_by_outcome ON runs (devoiced, score);
+CREATE INDEX IF NOT EXISTS runs_by_score ON runs (score);
+CREATE INDEX IF NOT EXISTS runs_by_speed ON runs (iterations_per_second);
+CREATE INDEX IF NOT EXISTS runs_by_seed ON runs (seed);
+'''
+
+# The columns of the runs table that queries can use.
+run_columns = ['log_file', 'recorded', 'seed', 'seconds', 'iterations_run',
+               'iterations_per_second', 'stop_reason', 'score', 'devoiced']
+
+def effective_parameters():
+    """Return the current value of every setting from `parameters.py`."""
+    return {name: value for name, value in vars(parameters).items()
+            if not name.startswith('_')
+               and not isinstance(value, types.ModuleType)}
+
+def meta_file_name(log_file):
+    """Return the name of the file that describes the run with the log."""
+    root, extension = os.path.splitext(log_file)
+    if extension == '.gz':
+        root = os.path.splitext(root)[0]
+    return root + '.meta'
+
+def describe_run(agents, log_file, run_info):
+    """Return a description of a finished run, for the catalogue."""
+    seconds = run_info.get('seconds')
+    return {'log_file': log_file,
+            'recorded': time(),
+            'parameters': effective_parameters(),
+            'seed': run_info.get('seed'),
+            'seconds': seconds,
+            'iterations_run': run_info['iterations_run'],
+            'iterations_per_second': run_info['iterations_run'] / seconds
+                                     if seconds else None,
+            'stop_reason': run_info['stop_reason'],
+            'outcome': devoicing_outcome(agents)}
+
+def write_meta(record):
+    """Write the description of a run next to its log."""
+    # Refer to the log by its name alone, so that the two can be moved
+    # together.
+    with open(meta_file_name(record['log_file']), 'w') as meta_out:
+        json.dump(dict(record, log_file = os.path.basename(
+                       record['log_file'])), meta_out, indent = 1,
+                  default = repr)
+
+def read_meta(file_name):
+    """Return the description of a run from its meta file (or its log's)."""
+    if not file_name.endswith('.meta'):
+        file_name = meta_file_name(file_name)
+    with open(file_name) as meta_in:
+        record = json.load(meta_in)
+    record['log_file'] = os.path.join(os.path.dirname(file_name),
+                                      record['log_file'])
+    return record
+
+def db_value(value):
+    """Return a parameter's value as stored in the catalogue."""
+    # Numbers and strings are stored as themselves (so that they compare as
+    # they would in Python), and anything else as JSON.
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return json.dumps(value, sort_keys = True, default = repr)
+
+def connect(catalogue_file = None):
+    """Open the catalogue (creating it if need be)."""
+    connection = sqlite3.connect(catalogue_file or default_catalogue,
+                                 timeout = 60)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(schema)
+    return connection
+
+def add_runs(catalogue_file, records):
+    """Add descriptions of runs to the catalogue; return their ids."""
+    connection = connect(catalogue_file)
+    run_ids = []
+    # Add all of them in one transaction, which is far faster than one each.
+    with connection:
+        for record in records:
+            log_file = record['log_file']
+            if log_file is not None:
+                log_file = os.path.abspath(log_file)
+                # A run that's added again replaces its old entry.
+                for table in ('parameters', 'medians'):
+                    connection.execute('DELETE FROM {} WHERE run_id IN '
+                                       '(SELECT id FROM runs WHERE '
+                                       'log_file = ?)'.format(table),
+                                       (log_file,))
+                connection.execute('DELETE FROM runs WHERE log_file = ?',
+                                   (log_file,))
+            outcome = record['outcome']
+            seed = record['seed']
+            run_id = connection.execute(
+                'INSERT INTO runs ({}) VALUES ({})'.format(
+                    ', '.join(run_columns), ', '.join('?' * len(run_columns))),
+                (log_file, record['recorded'],
+                 None if seed is None else str(seed), record['seconds'],
+                 record['iterations_run'], record['iterations_per_second'],
+                 record['stop_reason'], outcome['score'],
+                 int(outcome['devoiced']))).lastrowid
+            connection.executemany('INSERT INTO parameters VALUES (?, ?, ?)',
+                                   [(run_id, name, db_value(value))
+                                    for name, value in
+                                    record['parameters'].items()])
+            connection.executemany('INSERT INTO medians VALUES '
+                                   '(?, ?, ?, ?, ?)',
+                                   [(run_id, m['agent'], m['lemma'], m['case'],
+                                     m['vot_median'])
+                                    for m in outcome['medians']])
+            run_ids.append(run_id)
+    connection.close()
+    return run_ids
+
+def add_run(catalogue_file, record):
+    """Add the description of a run to the catalogue; return its id."""
+    return add_runs(catalogue_file, [record])[0]
+
+# The tokens of a query: numbers, strings, comparisons, parentheses, and names.
+token_pattern = re.compile(r'''\s*(?:
+    (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<string>'[^']*'|"[^"]*")
+  | (?P<op><=|>=|==|!=|<|>|=)
+  | (?P<paren>[()])
+  | (?P<name>[A-Za-z_]\w*))''', re.VERBOSE)
+
+# Names that stand for literal values in queries.
+constants = {'True': 1, 'False': 0, 'None': None}
+
+def tokenize(query):
+    """Split a query into (kind, text) tokens."""
+    tokens = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = token_pattern.match(query, position)
+        if match is None:
+            raise QuerySyntaxError('unexpected text: ' + query[position:])
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+def name_condition(name, op = None, value = None):
+    """Return SQL (and its arguments) for a condition on a name."""
+    if op is not None:
+        op = {'==': '='}.get(op, op)
+        # Comparisons with None are about whether there's a value at all.
+        if value is None:
+            if not op in ('=', '!='):
+                raise QuerySyntaxError('None can only be compared with = '
+                                       'or !=')
+            op = 'IS' if op == '=' else 'IS NOT'
+        test = ' {} ?'.format(op)
+        arguments = [value]
+    else:
+        # A name on its own stands for whether it's true.
+        test = ''
+        arguments = []
+    vot_name = re.fullmatch(r'vot_([a-z]+)_(\d+)', name)
+    if name in run_columns:
+        return 'runs.{}{}'.format(name, test), arguments
+    if vot_name is not None:
+        return ('runs.id IN (SELECT run_id FROM medians WHERE lemma = ? AND '
+                'case_name = ? AND vot_median{})'.format(test),
+                [int(vot_name.group(2)), vot_name.group(1)] + arguments)
+    if hasattr(parameters, name):
+        return ('runs.id IN (SELECT run_id FROM parameters WHERE name = ? AND '
+                'value{})'.format(test), [name] + arguments)
+    raise QuerySyntaxError('unknown name: ' + name)
+
+def parse_query(query):
+    """Translate a query into an SQL condition and its arguments."""
+    tokens = tokenize(query)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else (None, None)
+
+    def take(kind = None, text = None):
+        nonlocal position
+        token = peek()
+        if token[0] is None or (kind is not None and token[0] != kind) or \
+           (text is not None and token[1] != text):
+            raise QuerySyntaxError('expected {} at token {}'.format(
+                                   text or kind or 'more', position + 1))
+        position += 1
+        return token
+
+    def literal():
+        kind, text = take()
+        if kind == 'number':
+            return float(text) if set(text) & set('.eE') else int(text)
+        if kind == 'string':
+            return text[1:-1]
+        if kind == 'name' and text in constants:
+            return constants[text]
+        raise QuerySyntaxError('expected a value, not ' + text)
+
+    def factor():
+        kind, text = peek()
+        if (kind, text) == ('name', 'not'):
+            take()
+            sql, arguments = factor()
+            return 'NOT ({})'.format(sql), arguments
+        if (kind, text) == ('paren', '('):
+            take()
+            sql, arguments = disjunction()
+            take('paren', ')')
+            return '({})'.format(sql), arguments
+        name = take('name')[1]
+        if peek()[0] == 'op':
+            op = take()[1]
+            return name_condition(name, op, literal())
+        return name_condition(name)
+
+    def conjunction():
+        sql, arguments = factor()
+        while peek() == ('name', 'and'):
+            take()
+            more_sql, more_arguments = factor()
+            sql += ' AND ' + more_sql
+            arguments += more_arguments
+        return sql, arguments
+
+    def disjunction():
+        sql, arguments = conjunction()
+        while peek() == ('name', 'or'):
+            take()
+            more_sql, more_arguments = conjunction()
+            sql += ' OR ' + more_sql
+            arguments += more_arguments
+        return sql, arguments
+
+    if len(tokens) == 0:
+        return '1', []
+    sql, arguments = disjunction()
+    if position < len(tokens):
+        raise QuerySyntaxError('unexpected ' + tokens[position][1])
+    return sql, arguments
+
+def find_runs(query = None, catalogue_file = None, show = (), order = None,
+              limit = None):
+    """Return the runs in the catalogue that match the query.
+
+    Each run is a dictionary of its entry in the runs table, plus the values
+    of the parameters named in `show` (which may also name columns of the
+    runs table).  Runs are sorted by `order` (a column
+    of the runs table or a parameter, with a leading '-' for descending
+    order), and at most `limit` are returned.
+    """
+    condition, arguments = parse_query(query or '')
+    columns = ['runs.*']
+    column_arguments = []
+    for name in show:
+        # The names go into the SQL itself, so only known ones are allowed.
+        if name in run_columns:
+            continue
+        if not hasattr(parameters, name):
+            raise QuerySyntaxError('can only show parameters or the columns '
+                                   'of runs: ' + name)
+        columns.append('(SELECT value FROM parameters WHERE run_id = runs.id '
+                       'AND name = ?) AS "{}"'.format(name))
+        column_arguments.append(name)
+    sql = 'SELECT {} FROM runs WHERE {}'.format(', '.join(columns), condition)
+    if order is not None:
+        descending = order.startswith('-')
+        order = order.lstrip('-')
+        if not order in run_columns + ['id'] + list(show):
+            raise QuerySyntaxError('can only order by the columns of runs '
+                                   'or shown parameters: ' + order)
+        sql += ' ORDER BY "{}"{}'.format(order, ' DESC' if descending else '')
+    if limit is not None:
+        sql += ' LIMIT {}'.format(int(limit))
+    connection = connect(catalogue_file)
+    try:
+        return [dict(row) for row in
+                connection.execute(sql, column_arguments + arguments)]
+    finally:
+        connection.close()
+
+def main():
+    """Add runs to the catalogue, or query it, from the command line."""
+    parser = argparse.ArgumentParser(description = 'Index completed runs by '
+                                     'their parameters and outcomes.')
+    parser.add_argument('--catalogue', default = parameters.catalogue_file)
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    add = commands.add_parser('add')
+    add.add_argument('files', nargs = '+', help = 'logs, or their meta files')
+    query = commands.add_parser('query')
+    query.add_argument('query', nargs = '?', default = None)
+    query.add_argument('--show', nargs = '+', default = [],
+                       help = 'parameters to list for each run')
+    query.add_argument('--order', default = None,
+                       help = 'sort by a column of runs or a shown parameter')
+    query.add_argument('--descending', action = 'store_true')
+    query.add_argument('--limit', type = int, default = None)
+    args = parser.parse_args()
+    if args.command == 'add':
+        records = []
+        for file_name in args.files:
+            try:
+                records.append(read_meta(file_name))
+            except (OSError, ValueError) as error:
+                print('Skipping {}: {}'.format(file_name, error),
+                      file = sys.stderr)
+        add_runs(args.catalogue, records)
+        print('Added {} runs'.format(len(records)))
+    else:
+        try:
+            order = args.order
+            if order is not None and args.descending:
+                order = '-' + order
+            runs = find_runs(args.query, args.catalogue, args.show, order,
+                             args.limit)
+        except QuerySyntaxError as error:
+            sys.exit('Bad query: {}'.format(error))
+        columns = ['id', 'seed', 'score', 'devoiced', 'iterations_run',
+                   'iterations_per_second']
+        columns += [name for name in args.show
+                    if not name in columns + ['log_file']] + ['log_file']
+        print('\t'.join(columns))
+        for run in runs:
+            print('\t'.join(str(run[c]) for c in columns))
+        print('{} runs'.format(len(runs)), file = sys.stderr)
+
+class QuerySyntaxError(Exception):
+    """Exception raised when a query can't be understood."""
+    pass
+
+if __name__ == '__main__':
+    main()
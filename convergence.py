@@ -0,0 +1,96 @@
+from collections import deque
+from numpy import percentile
+from parameters import *
+
+def cloud_statistics(agent, feature = 'vot', positions = (0, 2)):
+    """Return the median and IQR of the feature in each of the Agent's clouds.
+
+    The result maps (agent, lemma, case, position) to (median, IQR).
+    """
+    values = dict()
+    for e in agent.exemplars:
+        for pos in positions:
+            if pos < len(e.segments) and \
+               feature in e.segments[pos].features:
+                key = (agent.agent_id, e.lemma, e.case, pos)
+                values.setdefault(key, []).append(
+                    e.segments[pos].features[feature])
+    stats = dict()
+    for key in values:
+        q1, median, q3 = percentile(values[key], [25, 50, 75])
+        stats[key] = (float(median), float(q3 - q1))
+    return stats
+
+class ConvergenceMonitor:
+    """Decide when the VOT distributions of every cloud have settled."""
+
+    def __init__(self, window = None, threshold = None, patience = None,
+                 check_interval = None, positions = (0, 2)):
+        """Initialize a monitor (by default, with the settings in parameters).
+
+        Every `check_interval` iterations, the median and IQR of each cloud are
+        compared with their values `window` iterations earlier.  Once the
+        largest change stays below `threshold` for `patience` iterations, the
+        run has converged.
+        """
+        self.window = convergence_window if window is None else window
+        self.threshold = convergence_threshold if threshold is None \
+                         else threshold
+        self.patience = convergence_patience if patience is None else patience
+        self.check_interval = convergence_check_interval \
+                              if check_interval is None else check_interval
+        self.positions = positions
+        self.last_check = 0
+        # Snapshots of the statistics, oldest first, covering the last
+        # `window` iterations.
+        self.history = deque()
+        self.stable_since = None
+        self.last_change = None
+        self.stop_reason = None
+
+    def change(self, old, new):
+        """Return the largest change in any statistic between two snapshots."""
+        changes = [abs(a - b)
+                   for key in new if key in old
+                   for a, b in zip(old[key], new[key])]
+        # If the clouds don't match up (a lemma has disappeared from some case,
+        # say), things are still changing.
+        if len(changes) == 0 or set(old) != set(new):
+            return float('inf')
+        return max(changes)
+
+    def update(self, i, agents):
+        """Take note of the agents' state after iteration i.
+
+        Return True if the run has converged and should stop.
+        """
+        if i - self.last_check < self.check_interval:
+            return False
+        self.last_check = i
+        stats = dict()
+        for agent in agents:
+            stats.update(cloud_statistics(agent, positions = self.positions))
+        self.history.append((i, stats))
+        # Drop snapshots that are older than the window, keeping the one that
+        # marks the window's start.
+        while len(self.history) > 1 and \
+              self.history[1][0] <= i - self.window:
+            self.history.popleft()
+        start, old_stats = self.history[0]
+        if i - start < self.window:
+            return False
+        self.last_change = self.change(old_stats, stats)
+        if self.last_change < self.threshold:
+            if self.stable_since is None:
+                self.stable_since = i
+            if i - self.stable_since >= self.patience:
+                self.stop_reason = ('converged at iteration {}: cloud VOT ' +
+                                    'medians and IQRs changed by less than ' +
+                                    '{} over every {}-iteration window for ' +
+                                    '{} iterations').format(i, self.threshold,
+                                                            self.window,
+                                                            self.patience)
+                return True
+        else:
+            self.stable_since = None
+        return False
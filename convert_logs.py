@@ -0,0 +1,205 @@
+"""Convert simulation logs into a compact columnar format.
+
+Usage:
+    python convert_logs.py LOG [LOG ...] [--output DIR] [--every N]
+                           [--features NAME ...] [--positions N ...]
+                           [--workers N] [--chunk-lines N]
+
+A log (`sim_raw_*.json`, or a gzipped copy of one) has one line per logged
+agent state.  It is read a chunk of lines at a time, the chunks are parsed in
+parallel, and the result is written to a directory (by default the log's name
+with `.columns` in place of `.json`) that holds one flat binary file per column
+plus `schema.json`, which describes the columns.  Each row is one segment of
+one exemplar of one logged agent state.  Only a bounded number of chunks is in
+memory at once, however long the log is.
+
+`read_columns()` loads a converted log as a dictionary of NumPy arrays.
+"""
+
+import argparse, gzip, json, os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import numpy as np
+from segment import all_features, feature_type
+from wordform import cases
+
+# The columns every converted log has, and their types.  Categorical columns
+# hold integer codes, which the schema translates back into values; missing
+# values are coded as -1 (or NaN, for continuous features).
+index_columns = [('timestep', 'int32'),
+                 ('agent_id', 'int32'),
+                 ('exemplar', 'int32'),
+                 ('lemma', 'int32'),
+                 ('case', 'int8'),
+                 ('position', 'int8'),
+                 ('seg_type', 'int8')]
+
+def value_codes(features = None):
+    """Return the integer code of each value of every categorical column."""
+    codes = {'case': sorted(cases),
+             'seg_type': ['C', 'V']}
+    for f in features or all_features:
+        if feature_type(f) == 'categorical':
+            codes[f] = sorted(all_features[f]['values'])
+    return {column: {value: code for code, value in enumerate(codes[column])}
+            for column in codes}
+
+def columns(features = None):
+    """Return the name and type of every column of a converted log."""
+    feature_columns = [(f, 'float32' if feature_type(f) == 'continuous'
+                           else 'int8')
+                       for f in sorted(features or all_features)]
+    return index_columns + feature_columns
+
+def open_log(file_name):
+    """Open a log (gzipped or not) for reading as text."""
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, 'rt')
+    return open(file_name)
+
+def parse_chunk(lines, every = 1, features = None, positions = None):
+    """Parse some lines of a log into arrays, one per column.
+
+    Only agent states whose timestep is a multiple of `every` are kept, and
+    only the features and segment positions given (if any are given).
+    """
+    codes = value_codes(features)
+    column_types = columns(features)
+    values = {name: [] for name, dtype in column_types}
+    for line in lines:
+        if line.strip() == '':
+            continue
+        state = json.loads(line)
+        timestep = state.get('timestep', 0)
+        if timestep % every != 0:
+            continue
+        for n, e in enumerate(state['exemplars']):
+            for pos, seg in enumerate(e['segments']):
+                if positions is not None and not pos in positions:
+                    continue
+                values['timestep'].append(timestep)
+                values['agent_id'].append(state['agent_id'])
+                values['exemplar'].append(n)
+                values['lemma'].append(e['lemma'])
+                values['case'].append(codes['case'][e['case']])
+                values['position'].append(pos)
+                values['seg_type'].append(codes['seg_type'][seg['seg_type']])
+                for name, dtype in column_types[len(index_columns):]:
+                    value = seg['features'].get(name)
+                    # Record continuous values as they are and categorical
+                    # ones by their code.
+                    if name in codes:
+                        value = -1 if value is None else codes[name][value]
+                    elif value is None:
+                        value = np.nan
+                    values[name].append(value)
+    return {name: np.array(values[name], dtype = dtype)
+            for name, dtype in column_types}
+
+def read_chunks(log_in, chunk_lines):
+    """Yield the lines of an open log, a chunk at a time."""
+    while True:
+        chunk = list(islice(log_in, chunk_lines))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def convert_log(log_file, output_dir = None, every = 1, features = None,
+                positions = None, workers = None, chunk_lines = 200):
+    """Convert a log into the columnar format; return the output directory."""
+    if output_dir is None:
+        output_dir = log_file[:-3] if log_file.endswith('.gz') else log_file
+        output_dir = os.path.splitext(output_dir)[0] + '.columns'
+    os.makedirs(output_dir, exist_ok = True)
+    column_types = columns(features)
+    column_files = {name: open(os.path.join(output_dir, name + '.bin'), 'wb')
+                    for name, dtype in column_types}
+    num_rows = 0
+    try:
+        with open_log(log_file) as log_in, \
+             ProcessPoolExecutor(max_workers = workers) as pool:
+            # Keep a few chunks per worker in flight, and write their results
+            # in the order of the log as they come back.
+            max_pending = 2 * (workers or os.cpu_count() or 1)
+            pending = []
+            def write_next():
+                nonlocal num_rows
+                arrays = pending.pop(0).result()
+                for name in column_files:
+                    arrays[name].tofile(column_files[name])
+                num_rows += len(arrays['timestep'])
+            for chunk in read_chunks(log_in, chunk_lines):
+                pending.append(pool.submit(parse_chunk, chunk, every,
+                                           features, positions))
+                if len(pending) >= max_pending:
+                    write_next()
+            while len(pending) > 0:
+                write_next()
+    finally:
+        for column_file in column_files.values():
+            column_file.close()
+    # Write the schema last, so that a directory with a schema is complete.
+    schema = {'source': os.path.basename(log_file),
+              'rows': num_rows,
+              'every': every,
+              'positions': positions,
+              'columns': [{'name': name, 'dtype': dtype,
+                           'file': name + '.bin'}
+                          for name, dtype in column_types],
+              'codes': {column: sorted(codes, key = codes.get)
+                        for column, codes in value_codes(features).items()}}
+    with open(os.path.join(output_dir, 'schema.json'), 'w') as schema_out:
+        json.dump(schema, schema_out, indent = 1)
+    return output_dir
+
+def read_schema(directory):
+    """Return the schema of a converted log."""
+    with open(os.path.join(directory, 'schema.json')) as schema_in:
+        return json.load(schema_in)
+
+def read_columns(directory, names = None, decode = False):
+    """Return the columns of a converted log as NumPy arrays.
+
+    If `decode` is true, categorical columns hold their values rather than
+    their codes (with None for missing values).
+    """
+    schema = read_schema(directory)
+    arrays = dict()
+    for column in schema['columns']:
+        if names is None or column['name'] in names:
+            arrays[column['name']] = np.fromfile(os.path.join(directory,
+                                                              column['file']),
+                                                 dtype = column['dtype'])
+    if decode:
+        for name in arrays:
+            if name in schema['codes']:
+                values = np.array(schema['codes'][name] + [None],
+                                  dtype = object)
+                arrays[name] = values[arrays[name]]
+    return arrays
+
+def main():
+    """Convert logs from the command line."""
+    parser = argparse.ArgumentParser(description = 'Convert simulation logs '
+                                     'into a compact columnar format.')
+    parser.add_argument('logs', nargs = '+')
+    parser.add_argument('--output', default = None,
+                        help = 'output directory (only with a single log)')
+    parser.add_argument('--every', type = int, default = 1,
+                        help = 'keep only timesteps that are multiples of N')
+    parser.add_argument('--features', nargs = '+', default = None,
+                        choices = sorted(all_features))
+    parser.add_argument('--positions', nargs = '+', type = int, default = None)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--chunk-lines', type = int, default = 200)
+    args = parser.parse_args()
+    if args.output is not None and len(args.logs) > 1:
+        parser.error('--output can only be used with a single log')
+    for log_file in args.logs:
+        output_dir = convert_log(log_file, args.output, args.every,
+                                 args.features, args.positions, args.workers,
+                                 args.chunk_lines)
+        print('{} -> {}'.format(log_file, output_dir))
+
+if __name__ == '__main__':
+    main()
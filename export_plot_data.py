@@ -0,0 +1,172 @@
+"""Compute the tables that `plot_results.R` draws, and write them as CSV files.
+
+Usage:
+    python export_plot_data.py LOG_OR_COLUMNS [--output-dir DIR] [--every N]
+                               [--positions N ...]
+
+The input is a log (`sim_raw_*.json`, gzipped or not) or a log already
+converted by `convert_logs.py`.  Two files are written:
+
+- `vot_tracker.csv`: for each timestep, agent, lemma, case, and consonant
+  position, the minimum, quartiles, and maximum of the cloud's VOT values
+  (Timestep, Agent, Lemma, Case, Position, VOT_MIN, VOT_Q1, VOT_MED, VOT_Q3,
+  VOT_MAX).
+- `last_cloud_vot.csv`: the VOT of each consonant of each exemplar in the
+  agents' clouds at the last timestep (Agent, Lemma, Case, VOT1, VOT3, ...).
+
+Positions are counted from 1 in both files, as in R.  Quartiles are computed
+the same way as R's default `quantile()`.
+"""
+
+import argparse, csv, os, tempfile, shutil
+import numpy as np
+from convert_logs import convert_log, read_columns, read_schema
+
+# The quantiles in the VOT tracker, and the names of their columns.
+tracker_quantiles = [(0, 'VOT_MIN'), (.25, 'VOT_Q1'), (.5, 'VOT_MED'),
+                     (.75, 'VOT_Q3'), (1, 'VOT_MAX')]
+
+def load_vot(source, every = 1, positions = None):
+    """Return the VOT columns of a log, or of a converted log, and its codes."""
+    # Convert a log first (keeping only what's needed).
+    temp_dir = None
+    if not os.path.isdir(source):
+        temp_dir = tempfile.mkdtemp()
+        source = convert_log(source, os.path.join(temp_dir, 'columns'),
+                             every = every, features = ['vot'],
+                             positions = positions)
+    try:
+        columns = read_columns(source, ['timestep', 'agent_id', 'exemplar',
+                                        'lemma', 'case', 'position', 'vot'])
+        codes = read_schema(source)['codes']
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors = True)
+    # Leave out segments without a VOT (vowels), and timesteps and positions
+    # that weren't asked for.
+    keep = ~np.isnan(columns['vot']) & (columns['timestep'] % every == 0)
+    if positions is not None:
+        keep &= np.isin(columns['position'], positions)
+    columns = {name: columns[name][keep] for name in columns}
+    # Logs record VOT to one decimal place; undo the rounding error of storing
+    # it in single precision.
+    columns['vot'] = np.round(columns['vot'].astype(np.float64), 1)
+    return columns, codes
+
+def group_quantiles(keys, values, probs):
+    """Return the quantiles of the values within each group of equal keys.
+
+    Return the keys of each group (sorted) and an array with a row for each
+    group and a column for each quantile.  Quantiles are interpolated linearly
+    between order statistics (R's default, type 7).
+    """
+    # Sort by the keys (the first one most significant), then by value.
+    order = np.lexsort((values,) + tuple(reversed(keys)))
+    keys = [k[order] for k in keys]
+    values = values[order]
+    # Find where each group starts.
+    new_group = np.zeros(len(values), dtype = bool)
+    new_group[:1] = True
+    for k in keys:
+        new_group[1:] |= k[1:] != k[:-1]
+    starts = np.flatnonzero(new_group)
+    sizes = np.diff(np.append(starts, len(values)))
+    quantiles = np.empty((len(starts), len(probs)))
+    for j, p in enumerate(probs):
+        h = (sizes - 1) * p
+        low = np.floor(h).astype(int)
+        high = np.minimum(low + 1, sizes - 1)
+        quantiles[:, j] = values[starts + low] + (h - low) * \
+                          (values[starts + high] - values[starts + low])
+    return [k[starts] for k in keys], quantiles
+
+def vot_tracker(columns):
+    """Return the rows of the VOT tracker table."""
+    (timesteps, agent_ids, lemmas, cases, positions), quantiles = \
+        group_quantiles([columns['timestep'], columns['agent_id'],
+                         columns['lemma'], columns['case'],
+                         columns['position']],
+                        columns['vot'], [p for p, name in tracker_quantiles])
+    return timesteps, agent_ids, lemmas, cases, positions + 1, quantiles
+
+def last_cloud_vot(columns):
+    """Return the VOT of each exemplar's consonants at the last timestep.
+
+    Return the positions (counting from 1) and the rows of the table.
+    """
+    last = columns['timestep'] == columns['timestep'].max()
+    last_columns = {name: columns[name][last] for name in columns}
+    positions = np.unique(last_columns['position'])
+    # Give each exemplar of each agent a row, and each position a column.
+    exemplars, row = np.unique(np.stack([last_columns['agent_id'],
+                                         last_columns['exemplar']], axis = 1),
+                               axis = 0, return_inverse = True)
+    row = row.reshape(-1)
+    column = np.searchsorted(positions, last_columns['position'])
+    vots = np.full((len(exemplars), len(positions)), np.nan)
+    vots[row, column] = last_columns['vot']
+    lemmas = np.zeros(len(exemplars), dtype = last_columns['lemma'].dtype)
+    lemmas[row] = last_columns['lemma']
+    cases = np.zeros(len(exemplars), dtype = last_columns['case'].dtype)
+    cases[row] = last_columns['case']
+    return positions + 1, (exemplars[:, 0], lemmas, cases, vots)
+
+def csv_value(value):
+    """Return a value as written in a CSV file for R."""
+    if isinstance(value, float) and np.isnan(value):
+        return 'NA'
+    return value
+
+def export_plot_data(source, output_dir = '.', every = 1, positions = None):
+    """Write the plotting tables for a log; return the names of the files."""
+    columns, codes = load_vot(source, every, positions)
+    if len(columns['vot']) == 0:
+        raise NoVOTError(source)
+    os.makedirs(output_dir, exist_ok = True)
+    tracker_file = os.path.join(output_dir, 'vot_tracker.csv')
+    timesteps, agent_ids, lemmas, cases, tracker_positions, quantiles = \
+        vot_tracker(columns)
+    case_names = np.array(codes['case'])
+    with open(tracker_file, 'w', newline = '') as tracker_out:
+        writer = csv.writer(tracker_out)
+        writer.writerow(['Timestep', 'Agent', 'Lemma', 'Case', 'Position'] +
+                        [name for p, name in tracker_quantiles])
+        writer.writerows(zip(timesteps.tolist(), agent_ids.tolist(),
+                             lemmas.tolist(), case_names[cases].tolist(),
+                             tracker_positions.tolist(),
+                             *quantiles.round(4).T.tolist()))
+    last_file = os.path.join(output_dir, 'last_cloud_vot.csv')
+    last_positions, (agent_ids, lemmas, cases, vots) = last_cloud_vot(columns)
+    with open(last_file, 'w', newline = '') as last_out:
+        writer = csv.writer(last_out)
+        writer.writerow(['Agent', 'Lemma', 'Case'] +
+                        ['VOT' + str(p) for p in last_positions.tolist()])
+        for agent_id, lemma, case, row in zip(agent_ids.tolist(),
+                                              lemmas.tolist(),
+                                              case_names[cases].tolist(),
+                                              vots.tolist()):
+            writer.writerow([agent_id, lemma, case] +
+                            [csv_value(v) for v in row])
+    return tracker_file, last_file
+
+def main():
+    """Export plotting tables from the command line."""
+    parser = argparse.ArgumentParser(description = 'Write the tables that '
+                                     'plot_results.R draws as CSV files.')
+    parser.add_argument('source', help = 'a log, or a converted log')
+    parser.add_argument('--output-dir', default = '.')
+    parser.add_argument('--every', type = int, default = 1,
+                        help = 'keep only timesteps that are multiples of N')
+    parser.add_argument('--positions', nargs = '+', type = int, default = None,
+                        help = 'segment positions to keep (counting from 0)')
+    args = parser.parse_args()
+    for file_name in export_plot_data(args.source, args.output_dir,
+                                      args.every, args.positions):
+        print(file_name)
+
+class NoVOTError(Exception):
+    """Exception raised when a log has no VOT values to export."""
+    pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,485 @@
+"""A local service that queues and runs simulation jobs.
+
+Usage:
+    python job_service.py serve [--dir DIR] [--workers N] [--max-queue N]
+                                [--host HOST] [--port N | --socket PATH]
+    python job_service.py submit [--set NAME=VALUE ...] [--priority N]
+                                 [--watch]
+    python job_service.py status [JOB]
+    python job_service.py watch JOB
+    python job_service.py cancel JOB
+    python job_service.py shutdown
+
+The server accepts jobs (settings to override in `parameters.py`), queues them,
+and runs them in a pool of worker processes, highest priority first (and in
+order of submission within a priority).  Submissions are refused while the
+queue is full.  Each job gets a directory with its log (`log.json`), its latest
+progress report (`metrics.prom`), and its result (`result.json`).
+
+Jobs are recorded in a journal (`jobs.json`), so the service can be stopped
+and restarted at any time.  On shutdown, running jobs save a checkpoint and
+are queued again; after a restart they continue from it.  Jobs that were
+running when the server died are started over.
+
+Clients talk to the server in lines of JSON, over TCP on localhost or over a
+Unix socket.
+"""
+
+import argparse, asyncio, itertools, json, os, signal, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter
+import log_utils
+import parameters
+from log_utils import atomic_write, load_checkpoint, save_checkpoint
+from outcomes import devoicing_outcome
+from simulation import configured, parse_setting, run_simulation, run_info
+
+# Where the service keeps its journal and its jobs' files.
+default_directory = 'sim_jobs'
+default_host = '127.0.0.1'
+default_port = 8765
+# How often (in seconds) watchers are sent progress reports.
+watch_interval = .5
+
+def job_files(job_dir):
+    """Return the names of the files a job keeps in its directory."""
+    return {name: os.path.join(job_dir, file_name)
+            for name, file_name in (('log', 'log.json'),
+                                    ('metrics', 'metrics.prom'),
+                                    ('result', 'result.json'),
+                                    ('checkpoint', 'checkpoint.pickle'),
+                                    ('stop', 'stop'))}
+
+def stop_request(job_dir):
+    """Return why the job has been asked to stop ('cancel' or 'suspend')."""
+    try:
+        with open(job_files(job_dir)['stop']) as stop_file:
+            return stop_file.read().strip() or None
+    except OSError:
+        return None
+
+def run_job(job_dir, config):
+    """Run (or continue) a job in a worker process; return how it ended.
+
+    A job asked to suspend saves a checkpoint to continue from later.
+    """
+    files = job_files(job_dir)
+    # Put the settings back afterwards, in case the worker process is reused
+    # for another job (see `Service.serve()`).
+    old_log_file = log_utils.log_file_name
+    log_utils.log_file_name = files['log']
+    try:
+        with configured(**dict(config, telemetry_output = files['metrics'])):
+            return continue_job(job_dir, files)
+    finally:
+        log_utils.log_file_name = old_log_file
+
+def continue_job(job_dir, files):
+    """Run a job with its settings in place; return how it ended."""
+    # Continue from the checkpoint, if there is one; otherwise start afresh.
+    state = load_checkpoint(files['checkpoint'])
+    if state['agents'] is not None:
+        # Drop whatever was logged after the checkpoint (by a run that died
+        # after resuming from it), so that no iteration is logged twice.
+        if os.path.exists(files['log']):
+            os.truncate(files['log'], state['log_bytes'])
+    elif os.path.exists(files['log']):
+        os.remove(files['log'])
+    seconds = state.get('seconds', 0)
+    start = perf_counter()
+    a1, a2 = run_simulation(quiet = True, agents = state['agents'],
+                            first_iteration = state['iterations'] + 1,
+                            should_stop = lambda i: stop_request(job_dir))
+    seconds += perf_counter() - start
+    request = stop_request(job_dir)
+    if os.path.exists(files['checkpoint']):
+        os.remove(files['checkpoint'])
+    if request == 'cancel':
+        return 'cancelled'
+    if request == 'suspend' and \
+       run_info['iterations_run'] < parameters.iterations:
+        save_checkpoint(files['checkpoint'], (a1, a2),
+                        run_info['iterations_run'], seconds = seconds,
+                        log_bytes = os.path.getsize(files['log'])
+                                    if os.path.exists(files['log']) else 0)
+        return 'suspended'
+    result = {'run_info': dict(run_info), 'seconds': seconds,
+              'iterations_per_second': run_info['iterations_run'] / seconds
+                                       if seconds > 0 else None,
+              'outcome': devoicing_outcome([a1, a2])}
+    with atomic_write(files['result']) as result_out:
+        json.dump(result, result_out, indent = 1)
+    return 'done'
+
+def ignore_interrupts():
+    """Leave Ctrl-C to the server (in a worker process).
+
+    Ctrl-C interrupts every process in the terminal's process group; the
+    server then asks the running jobs to save a checkpoint and stop.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def read_metrics(metrics_file):
+    """Return the values in a job's latest progress report."""
+    metrics = dict()
+    try:
+        with open(metrics_file) as metrics_in:
+            for line in metrics_in:
+                name, value = line.split()
+                metrics[name[len('sim_'):]] = float(value)
+    except (OSError, ValueError):
+        pass
+    return metrics
+
+class JobService:
+    """A queue of simulation jobs, run by a pool of worker processes."""
+
+    def __init__(self, directory = default_directory, workers = None,
+                 max_queue = 100):
+        self.directory = directory
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.jobs = dict()
+        self.queue = asyncio.PriorityQueue()
+        self.order = itertools.count()
+        self.accepting = True
+        self.stopped = asyncio.Event()
+        os.makedirs(directory, exist_ok = True)
+        self.load_journal()
+
+    def journal_file(self):
+        """Return the name of the journal."""
+        return os.path.join(self.directory, 'jobs.json')
+
+    def load_journal(self):
+        """Pick up the jobs recorded by an earlier run of the service."""
+        if not os.path.exists(self.journal_file()):
+            return
+        with open(self.journal_file()) as journal_in:
+            jobs = json.load(journal_in)
+        for job in sorted(jobs, key = lambda job: job['number']):
+            # Jobs that didn't finish are queued again.  Requests to stop
+            # them were for the last run of the service.
+            if job['state'] in ('queued', 'running'):
+                stop_file = job_files(self.job_dir(job['id']))['stop']
+                if os.path.exists(stop_file):
+                    os.remove(stop_file)
+                job['state'] = 'queued'
+                self.enqueue(job)
+            self.jobs[job['id']] = job
+        self.save_journal()
+
+    def save_journal(self):
+        """Record every job's state in the journal."""
+        with atomic_write(self.journal_file()) as journal_out:
+            json.dump(list(self.jobs.values()), journal_out, indent = 1)
+
+    def job_dir(self, job_id):
+        """Return the directory of a job's files."""
+        return os.path.join(self.directory, job_id)
+
+    def enqueue(self, job):
+        """Put a job in the queue."""
+        # Higher priorities first; earlier submissions first within one.
+        self.queue.put_nowait((-job['priority'], job['number'], job['id']))
+
+    def queued(self):
+        """Return the number of jobs waiting to run."""
+        return sum(job['state'] == 'queued' for job in self.jobs.values())
+
+    def submit(self, config, priority = 0):
+        """Add a job to the queue; return it."""
+        if not self.accepting:
+            raise JobServiceError('the service is shutting down')
+        if self.queued() >= self.max_queue:
+            raise JobServiceError('the queue is full ({} jobs)'.format(
+                                  self.max_queue))
+        for name in config:
+            if not hasattr(parameters, name):
+                raise JobServiceError('unknown setting: ' + name)
+        number = max((job['number'] for job in self.jobs.values()),
+                     default = 0) + 1
+        job = {'id': 'job{:06}'.format(number), 'number': number,
+               'config': config, 'priority': priority, 'state': 'queued',
+               'submitted': time.time(), 'started': None, 'finished': None,
+               'error': None}
+        os.makedirs(self.job_dir(job['id']), exist_ok = True)
+        self.jobs[job['id']] = job
+        self.enqueue(job)
+        self.save_journal()
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; return it."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise JobServiceError('no such job: ' + job_id)
+        if job['state'] == 'queued':
+            job['state'] = 'cancelled'
+            job['finished'] = time.time()
+            self.save_journal()
+        # A running job stops at the end of its current iteration.
+        elif job['state'] == 'running':
+            self.request_stop(job_id, 'cancel')
+        return job
+
+    def request_stop(self, job_id, request):
+        """Ask a running job to stop."""
+        with open(job_files(self.job_dir(job_id))['stop'], 'w') as stop_file:
+            stop_file.write(request)
+
+    def status(self, job_id):
+        """Return a job's state and its latest progress."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise JobServiceError('no such job: ' + job_id)
+        files = job_files(self.job_dir(job_id))
+        status = dict(job, progress = read_metrics(files['metrics']))
+        if job['state'] == 'done':
+            with open(files['result']) as result_in:
+                status['result'] = json.load(result_in)
+        return status
+
+    async def run_jobs(self, pool):
+        """Run jobs from the queue, one at a time, until the service stops."""
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, number, job_id = await self.queue.get()
+            # Stop when told to (leaving the rest of the queue for next time).
+            if job_id is None or not self.accepting:
+                return
+            job = self.jobs[job_id]
+            if job['state'] != 'queued':
+                continue
+            job['state'] = 'running'
+            job['started'] = job['started'] or time.time()
+            self.save_journal()
+            job_dir = self.job_dir(job_id)
+            try:
+                outcome = await loop.run_in_executor(pool, run_job, job_dir,
+                                                     job['config'])
+            except (BrokenProcessPool, KeyboardInterrupt, SystemExit):
+                # The worker died (or was interrupted) without finishing the
+                # job.  Run it again (from its checkpoint, if it saved one)
+                # the next time the service starts: the pool can't run any
+                # more jobs.
+                outcome = 'interrupted'
+                self.stop()
+            except Exception as error:
+                outcome = 'failed'
+                job['error'] = repr(error)
+            if os.path.exists(job_files(job_dir)['stop']):
+                os.remove(job_files(job_dir)['stop'])
+            # A suspended job goes back in the queue: for now if the service
+            # is still taking jobs, or else for the next start.
+            if outcome in ('suspended', 'interrupted'):
+                job['state'] = 'queued'
+                if self.accepting:
+                    self.enqueue(job)
+            else:
+                job['state'] = outcome
+                job['finished'] = time.time()
+            self.save_journal()
+
+    async def watch(self, job_id, writer):
+        """Send a job's progress to a client until the job is over."""
+        last = None
+        while True:
+            status = self.status(job_id)
+            message = {'job': job_id, 'state': status['state'],
+                       'progress': status['progress']}
+            if message != last:
+                await send(writer, message)
+                last = message
+            if not status['state'] in ('queued', 'running'):
+                await send(writer, dict(status, job = job_id, final = True))
+                return
+            await asyncio.sleep(watch_interval)
+
+    async def handle(self, reader, writer):
+        """Answer a client's requests."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    op = request.get('op')
+                    if op == 'submit':
+                        job = self.submit(request.get('config', {}),
+                                          request.get('priority', 0))
+                        await send(writer, {'ok': True, 'job': job['id']})
+                    elif op == 'status':
+                        if request.get('job') is None:
+                            await send(writer, {'ok': True, 'jobs':
+                                                list(self.jobs.values())})
+                        else:
+                            await send(writer, dict(self.status(
+                                                        request['job']),
+                                                    ok = True))
+                    elif op == 'watch':
+                        await self.watch(request['job'], writer)
+                    elif op == 'cancel':
+                        job = self.cancel(request['job'])
+                        await send(writer, {'ok': True, 'job': job['id'],
+                                            'state': job['state']})
+                    elif op == 'shutdown':
+                        await send(writer, {'ok': True})
+                        self.stop()
+                        break
+                    else:
+                        raise JobServiceError('unknown request: ' + str(op))
+                except (JobServiceError, KeyError, ValueError) as error:
+                    await send(writer, {'ok': False, 'error': str(error)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def stop(self):
+        """Stop taking jobs, and ask running jobs to save their progress."""
+        self.accepting = False
+        for job_id, job in self.jobs.items():
+            if job['state'] == 'running':
+                self.request_stop(job_id, 'suspend')
+        self.stopped.set()
+
+    async def serve(self, host = default_host, port = default_port,
+                    socket_path = None):
+        """Serve clients and run jobs until the service is stopped."""
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle, socket_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+        # Give every job a fresh process where Python allows it (3.11 and
+        # later), so that nothing one job leaves behind can affect the next.
+        # Jobs put their settings back anyway.
+        pool_options = dict()
+        if sys.version_info >= (3, 11):
+            pool_options['max_tasks_per_child'] = 1
+        with ProcessPoolExecutor(max_workers = self.workers,
+                                 initializer = ignore_interrupts,
+                                 **pool_options) as pool:
+            runners = [asyncio.create_task(self.run_jobs(pool))
+                       for w in range(self.workers)]
+            async with server:
+                await self.stopped.wait()
+            server.close()
+            # Let the running jobs reach a checkpoint; stop the idle runners.
+            for runner in runners:
+                self.queue.put_nowait((float('-inf'), 0, None))
+            await asyncio.gather(*runners)
+        self.save_journal()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+async def send(writer, message):
+    """Send a message as a line of JSON."""
+    writer.write((json.dumps(message) + '\n').encode())
+    await writer.drain()
+
+async def request(message, host = default_host, port = default_port,
+                  socket_path = None):
+    """Send a request to the service; yield its replies."""
+    if socket_path is not None:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await send(writer, message)
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            reply = json.loads(line)
+            yield reply
+            # Only watching gets more than one reply.
+            if message['op'] != 'watch' or reply.get('final'):
+                return
+    finally:
+        writer.close()
+
+def print_progress(reply):
+    """Print a progress report from the service."""
+    progress = reply.get('progress', {})
+    if 'iteration' in progress:
+        print('{} {}: {}/{} ({:.1f} it/s)'.format(reply['job'],
+              reply['state'], int(progress['iteration']),
+              int(progress['total_iterations']),
+              progress.get('window_iterations_per_second', 0)))
+    else:
+        print('{} {}'.format(reply['job'], reply['state']))
+
+async def client(args):
+    """Carry out a client command; return the exit status."""
+    connection = {'host': args.host, 'port': args.port,
+                  'socket_path': args.socket}
+    if args.command == 'submit':
+        message = {'op': 'submit', 'config': dict(args.set),
+                   'priority': args.priority}
+    elif args.command == 'status':
+        message = {'op': 'status', 'job': args.job}
+    else:
+        message = {'op': args.command, 'job': getattr(args, 'job', None)}
+    async for reply in request(message, **connection):
+        if reply.get('ok') is False:
+            print('Error: ' + reply['error'], file = sys.stderr)
+            return 1
+        if args.command == 'watch':
+            print_progress(reply)
+            if reply.get('final'):
+                print(json.dumps(reply.get('result', reply), indent = 1))
+        elif args.command == 'status' and args.job is None:
+            for job in reply['jobs']:
+                print('{}  {:<9}  priority {}  {}'.format(job['id'],
+                      job['state'], job['priority'],
+                      json.dumps(job['config'])))
+        else:
+            print(json.dumps(reply, indent = 1))
+    if args.command == 'submit' and args.watch:
+        args.command, args.job = 'watch', reply['job']
+        return await client(args)
+    return 0
+
+def main():
+    """Run the service, or talk to it, from the command line."""
+    parser = argparse.ArgumentParser(description = 'Queue and run '
+                                     'simulation jobs.')
+    parser.add_argument('--host', default = default_host)
+    parser.add_argument('--port', type = int, default = default_port)
+    parser.add_argument('--socket', default = None,
+                        help = 'use a Unix socket instead of TCP')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    serve = commands.add_parser('serve')
+    serve.add_argument('--dir', default = default_directory)
+    serve.add_argument('--workers', type = int, default = None)
+    serve.add_argument('--max-queue', type = int, default = 100)
+    submit = commands.add_parser('submit')
+    submit.add_argument('--set', action = 'append', default = [],
+                        type = parse_setting,
+                        help = 'override a setting (NAME=VALUE)')
+    submit.add_argument('--priority', type = int, default = 0)
+    submit.add_argument('--watch', action = 'store_true')
+    status = commands.add_parser('status')
+    status.add_argument('job', nargs = '?', default = None)
+    for command in ('watch', 'cancel'):
+        commands.add_parser(command).add_argument('job')
+    commands.add_parser('shutdown')
+    args = parser.parse_args()
+    if args.command == 'serve':
+        service = JobService(args.dir, args.workers, args.max_queue)
+        asyncio.run(service.serve(args.host, args.port, args.socket))
+    else:
+        sys.exit(asyncio.run(client(args)))
+
+class JobServiceError(Exception):
+    """Exception raised when the service can't carry out a request."""
+    pass
+
+if __name__ == '__main__':
+    main()
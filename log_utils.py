@@ -1,17 +1,22 @@
-import json, datetime
+import json, datetime, os, pickle, socket
+from contextlib import contextmanager
 from agent import Agent
 from wordform import WordForm
 from segment import Segment
+from profiling import phase
+import rng
 
 log_file_name = 'sim_raw_' + datetime.datetime.now().strftime("%Y-%m-%d-%H:%M.%S") + '.json'
 
 class CustomEncoder(json.JSONEncoder):
     def default(self, obj):
         """Deal with custom classes for JSON."""
-        # Turn Agents, WordForms, and Segments into dictionaries.
+        # Turn Agents, WordForms, and Segments into dictionaries.  Leave out
+        # private attributes (such as an Agent's pooled buffers).
         if isinstance(obj, (Agent, WordForm, Segment)):
             return {key: CustomEncoder.default(self, obj.__dict__[key])
-                    for key in obj.__dict__}
+                    for key in obj.__dict__
+                    if not key.startswith('_')}
         # Round floats to one decimal place.
         elif isinstance(obj, float):
             return round(obj, 1)
@@ -35,6 +40,50 @@ def start_logging():
 
 def log_state(agent):
     """Record the Agent's current state to the log file."""
-    with open(log_file_name, 'a') as log_file:
-        log_file.write(json.dumps(agent, cls = CustomEncoder))
-        log_file.write('\n')
+    with phase('logging'):
+        with open(log_file_name, 'a') as log_file:
+            log_file.write(json.dumps(agent, cls = CustomEncoder))
+            log_file.write('\n')
+
+@contextmanager
+def atomic_write(file_name, mode = 'w'):
+    """Open a file to write that replaces the one named once it's complete.
+
+    Readers never see the file half-written, and an interrupted write leaves
+    the old file as it was.
+    """
+    # The temporary file is unique to this process, even on another host
+    # sharing the directory.
+    temp_file = '{}.{}.{}.tmp'.format(file_name, socket.gethostname(),
+                                      os.getpid())
+    try:
+        with open(temp_file, mode) as out:
+            yield out
+        os.replace(temp_file, file_name)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def save_checkpoint(file_name, agents, iterations, **extra):
+    """Save a run (its agents and random stream) to continue later.
+
+    Anything else to be kept with the run can be passed as keyword arguments.
+    """
+    state = dict(extra, agents = agents, stream = rng.get_stream(),
+                 iterations = iterations)
+    with atomic_write(file_name, 'wb') as checkpoint_out:
+        pickle.dump(state, checkpoint_out)
+
+def load_checkpoint(file_name):
+    """Pick up a run saved with `save_checkpoint()`, if there is one.
+
+    The run's random stream is restored.  Return what was saved: the agents,
+    the number of iterations run, and anything else.  With no checkpoint, the
+    agents are None and no iterations have been run.
+    """
+    if not os.path.exists(file_name):
+        return {'agents': None, 'iterations': 0}
+    with open(file_name, 'rb') as checkpoint_in:
+        state = pickle.load(checkpoint_in)
+    rng.set_stream(state['stream'])
+    return state
@@ -0,0 +1,63 @@
+from numpy import median
+from segment import category_to_range
+
+# The consonant position at the end of the stem: word-final in the absolutive
+# (which has no suffix) and medial in the ergative (which has one).
+stem_final_position = 2
+
+def vot_medians(agents, position = stem_final_position):
+    """Return the median VOT at the position in each of the agents' clouds.
+
+    The result maps (agent, lemma, case) to the median.
+    """
+    values = dict()
+    for agent in agents:
+        for e in agent.exemplars:
+            if position < len(e.segments) and \
+               'vot' in e.segments[position].features:
+                values.setdefault((agent.agent_id, e.lemma, e.case), []).\
+                    append(e.segments[position].features['vot'])
+    return {key: float(median(values[key])) for key in values}
+
+def underlyingly_voiced(lemma):
+    """Return whether the lemma started out with voiced consonants."""
+    # Odd-numbered lemmas are seeded voiced (see `initialize_agent()`).
+    return lemma % 2 == 1
+
+def devoicing_outcome(agents):
+    """Measure how close the agents are to German-style final devoicing.
+
+    Final devoicing means that stem-final consonants are voiceless in the
+    absolutive, where they are word-final, for every lemma; while in the
+    ergative, where they are followed by the suffix, they keep the voicing they
+    started out with.  Return the per-cloud medians (as a list of records), a
+    score between 0 and 1 (the product of how devoiced the absolutive is and
+    how well the ergative contrast is preserved), and whether devoicing has
+    emerged outright.
+    """
+    medians = vot_medians(agents)
+    boundary = category_to_range('vot', 'voiced')[1]
+    # How far each median has moved across the voicing boundary, on a scale
+    # from 0 (VOT 25 or less on the wrong side) to 1 (VOT 75 or more on the
+    # right side).
+    def side(value, voiceless):
+        shift = value - boundary if voiceless else boundary - value
+        return min(1, max(0, (shift + 25) / 50))
+    neutralization = [side(medians[key], True)
+                      for key in medians if key[2] == 'abs']
+    contrast = [side(medians[key], not underlyingly_voiced(key[1]))
+                for key in medians if key[2] == 'erg']
+    devoiced = len(neutralization) > 0 and len(contrast) > 0 and \
+               all(medians[key] > boundary
+                   for key in medians if key[2] == 'abs') and \
+               all((medians[key] < boundary) == underlyingly_voiced(key[1])
+                   for key in medians if key[2] == 'erg')
+    score = 0
+    if len(neutralization) > 0 and len(contrast) > 0:
+        score = sum(neutralization) / len(neutralization) * \
+                sum(contrast) / len(contrast)
+    return {'medians': [{'agent': a, 'lemma': l, 'case': c,
+                         'vot_median': medians[(a, l, c)]}
+                        for (a, l, c) in sorted(medians)],
+            'score': score,
+            'devoiced': devoiced}
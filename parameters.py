@@ -32,8 +32,59 @@ kde_resolution = .1
 # What is the bandwidth used during kernel density estimation?
 kde_bandwidth = 5
 
+# What seed should be used for the simulation's random numbers?  None: seed from
+# the operating system (a different run every time).
+random_seed = None
+# How many random numbers should be drawn at once and handed out as needed?
+random_block_size = 4096
+
 # How many iterations of the simulation should be run?
 iterations = 3000
+# How many tokens should an agent produce per round of interaction?  In a round,
+# the speaker produces all its tokens from a frozen snapshot of its cloud
+# (computing entrenchment targets once for the whole round), and the listener
+# categorizes all of them against a frozen snapshot of its own cloud before
+# storing any.  With 1, each token is produced and stored before the next one,
+# exactly as in the sequential simulation; larger values trade fidelity for
+# speed.
+round_size = 1
+# How many threads should work out the entrenchment targets of a production
+# (informativity weights and KDE maxima) at once?  1: one target at a time, as
+# it's needed.  With more, which features get entrenched is decided up front,
+# and random numbers used in working out a target come from a stream of its
+# own, so a seeded run differs from the run with 1 thread (though not with the
+# number of threads).
+entrenchment_threads = 1
+# Should the agents share one pool of stored exemplars?  Stored exemplars are
+# then never changed in place, and identical exemplars are stored only once.
+# This saves memory only when many stored exemplars are exact copies (which
+# noise makes rare); otherwise it costs a little.
+shared_pool_setting = False
+# In what precision should the continuous feature values of stored exemplars
+# be kept?  'double': as they are.  'single': rounded to single precision, with
+# the agents' pooled arrays of values (which the KDEs run on) holding 32-bit
+# floats.  'fixed': rounded to a multiple of `fixed_point_resolution`, with the
+# pooled arrays holding 16-bit integers.  Values are rounded when they're
+# stored, so the model sees the same values everywhere (see the README for the
+# effect on runs).  Only the KDE buffers shrink: the exemplars themselves
+# still hold Python floats, so this saves almost no memory.
+feature_precision = 'double'
+# To what resolution are values rounded with `feature_precision = 'fixed'`?
+fixed_point_resolution = .1
+# Should the simulation stop early once the VOT distributions of all clouds
+# have settled?
+convergence_setting = False
+# Over how many iterations is the change in each cloud's VOT median and IQR
+# measured?
+convergence_window = 200
+# How small must the largest change in any cloud's VOT median or IQR over the
+# window be for the clouds to count as stable?
+convergence_threshold = 2
+# For how many iterations must the clouds stay stable before the simulation
+# stops?
+convergence_patience = 400
+# How often (in iterations) should the clouds be checked?
+convergence_check_interval = 20
 # How many lemmas are there in the simulation?
 num_lemmas = 2
 
@@ -51,11 +102,34 @@ categorization_setting = 'similarity'
 # continuous features).  'classification': the performance of the categorization
 # algorithm set above in `categorization_setting`.  'none': none.
 informativity_setting = 'classification'
+# When informativity is measured via classification, how many held-out
+# exemplars of each case should the classifier's performance be estimated from?
+# None: all of them (exact leave-one-out cross-validation).
+informativity_sample_size = None
+# Alternatively, stop holding out exemplars once the 95% confidence interval of
+# the estimated performance is narrower than +/- this amount.  None: don't.
+informativity_target_ci = None
 # Should paradigms have a unique base ('winner-take-all' application of
 # `informativity_setting`)?
 unique_base_setting = True
 # Verbose output?
 verbose_setting = False
+# Should the state of each agent be written to the log file after every
+# interaction?
+logging_setting = True
+# Where should progress reports (throughput, latency, memory, and log size) go?
+# 'stderr': print them.  A file name: keep the latest values in that file, for
+# a metrics scraper to read.  None: don't report progress.
+telemetry_output = 'stderr'
+# How many iterations should pass between progress reports?
+telemetry_interval = 200
+# Should the time spent in each phase of production, storage, and logging be
+# measured and reported at the end of the run?
+profiling_setting = False
+# Which iterations (first, last) should also be run under cProfile?  None: none.
+profile_window = None
+# Where should the cProfile statistics be saved?
+profile_file = 'sim_profile.prof'
 # What is the largest amount a feature is allowed to change during entrenchment
 # within a wordform's own cloud?
 self_max_movement = 100
@@ -74,3 +148,13 @@ segment_max_movement = 100
 # During entrenchment with all segments of the same type, should a global
 # maximum be returned (as opposed to a local maximum)?
 segment_top_value = False
+
+# Where should the results of runs be cached?
+cache_directory = '.sim_cache'
+# How large (in bytes) may the cache grow before old results are evicted?
+cache_max_bytes = 2 ** 30
+
+# In what SQLite database should finished runs be catalogued, by their
+# parameters and outcomes?  Runs that keep a log also describe themselves in a
+# file next to it, for `catalogue.py add`.  None: don't catalogue runs.
+catalogue_file = None
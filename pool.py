@@ -0,0 +1,85 @@
+from wordform import WordForm
+from copy import deepcopy
+
+def content_key(wordform):
+    """Return a hashable description of everything stored in a WordForm."""
+    return (wordform.lemma, wordform.case,
+            tuple((seg.seg_type, tuple(seg.features.items()))
+                  for seg in wordform.segments))
+
+def content_digest(wordform):
+    """Return a hash of everything stored in a WordForm."""
+    return hash(content_key(wordform))
+
+class ExemplarPool:
+    """Stored exemplars shared by all Agents, with reference counts.
+
+    Exemplars in the pool are never changed in place: an Agent that wants a
+    different version of a stored exemplar (with a different lemma, say) adds a
+    new entry to the pool instead.  Identical exemplars share a single entry.
+    Exemplars with continuous noise are rarely identical, so the pool only
+    saves memory when many exact copies are stored.
+    """
+
+    def __init__(self):
+        """Initialize an empty pool."""
+        # For each slot: the stored WordForm and the number of references to
+        # it (a slot with no references is free to be reused).
+        self.entries = []
+        self.refcounts = []
+        self.free_slots = []
+        # The slot in which each distinct exemplar is stored, by a hash of its
+        # contents (rather than a copy of them, which would cost as much memory
+        # as the exemplar itself).
+        self.slots_by_digest = dict()
+
+    def intern(self, wordform):
+        """Add a reference to the WordForm; return its slot in the pool."""
+        key = content_key(wordform)
+        digest = hash(key)
+        slot = self.slots_by_digest.get(digest)
+        # If an identical exemplar is already stored, share it.  (Compare the
+        # contents, in case two different exemplars have the same hash.)
+        if slot is not None and content_key(self.entries[slot]) == key:
+            self.refcounts[slot] += 1
+            return slot
+        # Otherwise, store this one (reusing a free slot if there is one).
+        if len(self.free_slots) > 0:
+            slot = self.free_slots.pop()
+            self.entries[slot] = wordform
+            self.refcounts[slot] = 1
+        else:
+            slot = len(self.entries)
+            self.entries.append(wordform)
+            self.refcounts.append(1)
+        # Index the new exemplar, unless its hash is already taken by a
+        # different one (which then just won't be shared).
+        if not digest in self.slots_by_digest:
+            self.slots_by_digest[digest] = slot
+        return slot
+
+    def release(self, slot):
+        """Remove a reference to the exemplar in the slot."""
+        self.refcounts[slot] -= 1
+        # Free the slot once nothing refers to it any more.
+        if self.refcounts[slot] == 0:
+            digest = content_digest(self.entries[slot])
+            if self.slots_by_digest.get(digest) == slot:
+                del self.slots_by_digest[digest]
+            self.entries[slot] = None
+            self.free_slots.append(slot)
+
+    def relabel(self, wordform, lemma):
+        """Return a copy of a WordForm to store, with the lemma given."""
+        # Copy the Segments too: the WordForm still belongs to the caller, who
+        # may go on using (or changing) it, while what's stored never changes.
+        return WordForm(deepcopy(wordform.segments), lemma = lemma,
+                        case = wordform.case)
+
+    def __getitem__(self, slot):
+        """Return the exemplar stored in the slot."""
+        return self.entries[slot]
+
+    def __len__(self):
+        """Return the number of distinct exemplars in the pool."""
+        return len(self.entries) - len(self.free_slots)
@@ -0,0 +1,150 @@
+import cProfile, sys, threading
+from collections import defaultdict, Counter
+from contextlib import nullcontext
+from time import perf_counter
+
+# Phases that run inside other phases.  Their time is also counted in the time
+# of the phase that contains them.
+nested_phases = {'informativity': 'entrench_paradigm'}
+
+# Phases can be timed, and calls counted, in several threads at once (see
+# `entrenchment_threads`).
+profiler_lock = threading.Lock()
+
+class PhaseTimer:
+    """A context manager that adds its elapsed time to a phase."""
+
+    def __init__(self, times, name):
+        self.times = times
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = perf_counter() - self.start
+        with profiler_lock:
+            self.times[self.name].append(elapsed)
+        return False
+
+class Profiler:
+    """Timers and call counters for the phases of the simulation."""
+
+    def __init__(self):
+        """Initialize a disabled profiler with no data."""
+        self.enabled = False
+        self.null_timer = nullcontext()
+        self.reset()
+
+    def reset(self):
+        """Throw away all the data collected so far."""
+        self.times = defaultdict(list)
+        self.counts = Counter()
+        self.cprofile = None
+        self.cprofile_window = None
+        self.cprofile_file = None
+        self.cprofile_done = False
+
+    def enable(self, window = None, cprofile_file = None):
+        """Start collecting data.
+
+        If a window (first iteration, last iteration) is given, the iterations
+        in that window are also run under cProfile, and its statistics are
+        written to `cprofile_file`.
+        """
+        self.enabled = True
+        self.cprofile_window = window
+        self.cprofile_file = cprofile_file
+
+    def disable(self):
+        """Stop collecting data."""
+        self.enabled = False
+
+    def phase(self, name):
+        """Return a context manager that times a phase."""
+        # When the profiler is off, don't even look at the clock.
+        if not self.enabled:
+            return self.null_timer
+        return PhaseTimer(self.times, name)
+
+    def count(self, name, n = 1):
+        """Count calls to a hot path."""
+        if self.enabled:
+            with profiler_lock:
+                self.counts[name] += n
+
+    def iteration(self, i):
+        """Start or stop cProfile at the edges of the chosen window."""
+        if not self.enabled or self.cprofile_window is None:
+            return
+        first, last = self.cprofile_window
+        if self.cprofile is None and not self.cprofile_done and \
+           first <= i <= last:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        elif self.cprofile is not None and i > last:
+            self.stop_cprofile()
+
+    def stop_cprofile(self):
+        """Stop cProfile (if it's running) and save its statistics."""
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_file)
+            self.cprofile = None
+            self.cprofile_done = True
+
+    def summary(self):
+        """Return the total time and percentiles of each phase."""
+        summary = dict()
+        for name in self.times:
+            times = sorted(self.times[name])
+            summary[name] = {'calls': len(times),
+                             'total': sum(times),
+                             'mean': sum(times) / len(times),
+                             'p50': percentile(times, 50),
+                             'p90': percentile(times, 90),
+                             'p99': percentile(times, 99),
+                             'max': times[-1]}
+        return summary
+
+    def report(self, out = sys.stderr):
+        """Print the phase timings and call counts."""
+        self.stop_cprofile()
+        summary = self.summary()
+        print('{:<20}{:>9}{:>11}{:>11}{:>11}{:>11}{:>11}'.format(
+            'phase', 'calls', 'total (s)', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)',
+            'max (ms)'), file = out)
+        for name in sorted(summary, key = lambda n: -summary[n]['total']):
+            s = summary[name]
+            label = name
+            if name in nested_phases:
+                label = '  ' + name
+            print('{:<20}{:>9}{:>11.3f}{:>11.3f}{:>11.3f}{:>11.3f}{:>11.3f}'.\
+                  format(label, s['calls'], s['total'], 1000 * s['p50'],
+                         1000 * s['p90'], 1000 * s['p99'], 1000 * s['max']),
+                  file = out)
+        if len(self.counts) > 0:
+            print(file = out)
+            print('{:<20}{:>9}'.format('counter', 'calls'), file = out)
+        for name in sorted(self.counts):
+            print('{:<20}{:>9}'.format(name, self.counts[name]), file = out)
+        if self.cprofile_file is not None and self.cprofile_window is not None:
+            print('cProfile statistics for iterations {}-{}: {}'.format(
+                *self.cprofile_window, self.cprofile_file), file = out)
+
+def percentile(sorted_values, p):
+    """Return the pth percentile (nearest rank) of a sorted list."""
+    index = max(0, -(-p * len(sorted_values) // 100) - 1)
+    return sorted_values[int(index)]
+
+# The profiler used by the simulation.
+profiler = Profiler()
+
+def phase(name):
+    """Return a context manager that times a phase of the simulation."""
+    return profiler.phase(name)
+
+def count(name, n = 1):
+    """Count a call to one of the simulation's hot paths."""
+    profiler.count(name, n)
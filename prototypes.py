@@ -0,0 +1,111 @@
+from segment import feature_type, label_codes, label_values, value_to_category
+from fractions import Fraction
+
+class CloudPrototype:
+    """Running summaries of the feature values in one cloud of exemplars."""
+
+    def __init__(self):
+        """Initialize the summaries of an empty cloud."""
+        self.size = 0
+        # The exemplar added last, to give the prototype its shape (which is
+        # the same for every exemplar in the cloud, and stays the same after
+        # the exemplar is replaced).
+        self.exemplar = None
+        # For each position and continuous feature, the sum and number of the
+        # values in each category.  Sums are kept exactly (as fractions), so
+        # that adding and removing values never accumulates rounding error,
+        # and means come out exactly as `statistics.mean()` would have them.
+        self.sums = dict()
+        self.value_counts = dict()
+        # For each position and categorical feature, the number of times each
+        # value occurs (in code order).
+        self.label_counts = dict()
+
+    def update(self, exemplar, change):
+        """Add (change 1) or remove (change -1) an exemplar's values."""
+        self.size += change
+        if change > 0:
+            self.exemplar = exemplar
+        for pos, seg in enumerate(exemplar.segments):
+            if pos < 3:
+                for feat, value in seg.features.items():
+                    key = (pos, feat)
+                    if feature_type(feat) == 'continuous':
+                        category = value_to_category(feat, value)
+                        sums = self.sums.setdefault(key, dict())
+                        counts = self.value_counts.setdefault(key, dict())
+                        sums[category] = sums.get(category, 0) + \
+                                         change * Fraction(value)
+                        counts[category] = counts.get(category, 0) + change
+                    else:
+                        if not key in self.label_counts:
+                            self.label_counts[key] = [0] * \
+                                                     len(label_values[feat])
+                        self.label_counts[key][label_codes[feat][value]] += \
+                            change
+
+    def add(self, exemplar):
+        """Add an exemplar's values to the summaries."""
+        self.update(exemplar, 1)
+
+    def remove(self, exemplar):
+        """Remove an exemplar's values from the summaries."""
+        self.update(exemplar, -1)
+
+    def mean(self, position, feature, possible_values = None):
+        """Return the mean of a continuous feature at the position.
+
+        Only values in the categories given count, if they're given.  Return
+        None if there are no such values.
+        """
+        sums = self.sums.get((position, feature), dict())
+        counts = self.value_counts.get((position, feature), dict())
+        categories = [c for c in counts
+                      if possible_values is None or c in possible_values]
+        n = sum(counts[c] for c in categories)
+        if n == 0:
+            return None
+        return float(sum(sums[c] for c in categories) / n)
+
+    def modes(self, position, feature, possible_values = None):
+        """Return the most common values of a categorical feature.
+
+        Only the values given count, if they're given.
+        """
+        counts = self.label_counts.get((position, feature), [])
+        present = [(count, label_values[feature][code])
+                   for code, count in enumerate(counts)
+                   if count > 0 and (possible_values is None or
+                                     label_values[feature][code] in
+                                     possible_values)]
+        if len(present) == 0:
+            return []
+        top = max(count for count, value in present)
+        return [value for count, value in present if count == top]
+
+    def common_values(self, position, feature, possible_values = None):
+        """Return the most common values of the feature at the position.
+
+        This is what `get_common_values()` returns for the whole cloud.
+        """
+        if feature_type(feature) == 'categorical':
+            return set(self.modes(position, feature, possible_values))
+        mean = self.mean(position, feature, possible_values)
+        return set() if mean is None else {mean}
+
+    def summary(self):
+        """Return the mean or modes of each feature at each position."""
+        summary = dict()
+        for key in self.sums:
+            mean = self.mean(*key)
+            if mean is not None:
+                summary[key] = mean
+        for key in self.label_counts:
+            modes = self.modes(*key)
+            if len(modes) > 0:
+                summary[key] = modes
+        return summary
+
+    def __len__(self):
+        """Return the number of exemplars in the cloud."""
+        return self.size
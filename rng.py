@@ -0,0 +1,151 @@
+from numpy.random import default_rng, SeedSequence
+from bisect import bisect_right
+from itertools import accumulate
+from contextlib import contextmanager
+import threading
+from parameters import *
+
+class RandomStream:
+    """A seeded source of random numbers, drawn from NumPy in large blocks."""
+
+    def __init__(self, seed = None, block_size = None):
+        """Initialize with a seed (an integer or a NumPy SeedSequence)."""
+        self.seed_sequence = seed
+        if not isinstance(seed, SeedSequence):
+            self.seed_sequence = SeedSequence(seed)
+        self.generator = default_rng(self.seed_sequence)
+        self.block_size = block_size
+        if block_size is None:
+            self.block_size = random_block_size
+        # Pre-drawn uniform and standard normal values, kept as Python floats
+        # so that handing them out is cheap.
+        self.uniforms = []
+        self.uniform_index = 0
+        self.normals = []
+        self.normal_index = 0
+
+    def random(self):
+        """Return a random float in [0, 1)."""
+        # Draw a new block if the current one has been used up.
+        if self.uniform_index == len(self.uniforms):
+            self.uniforms = self.generator.random(self.block_size).tolist()
+            self.uniform_index = 0
+        value = self.uniforms[self.uniform_index]
+        self.uniform_index += 1
+        return value
+
+    def uniform(self, a, b):
+        """Return a random float between a and b."""
+        return a + (b - a) * self.random()
+
+    def gauss(self, mu, sigma):
+        """Return a random float from a normal distribution."""
+        # Draw a new block if the current one has been used up.
+        if self.normal_index == len(self.normals):
+            self.normals = self.generator.standard_normal(self.block_size).\
+                           tolist()
+            self.normal_index = 0
+        value = self.normals[self.normal_index]
+        self.normal_index += 1
+        return mu + sigma * value
+
+    def choice(self, seq):
+        """Return a random element of the non-empty sequence provided."""
+        if len(seq) == 0:
+            raise IndexError('Cannot choose from an empty sequence')
+        # There's nothing to decide if there's only one option, so don't use up
+        # a random value.
+        if len(seq) == 1:
+            return seq[0]
+        return seq[int(self.random() * len(seq))]
+
+    def weighted_choice(self, seq, p):
+        """Return a random element of the sequence, with probabilities p."""
+        cumulative = list(accumulate(p))
+        index = bisect_right(cumulative, self.random() * cumulative[-1])
+        return seq[min(index, len(seq) - 1)]
+
+    def sample(self, seq, k):
+        """Return k distinct elements of the sequence, in random order."""
+        # Do the first k steps of a Fisher-Yates shuffle.
+        pool = list(seq)
+        k = min(k, len(pool))
+        for i in range(k):
+            j = i + int(self.random() * (len(pool) - i))
+            pool[i], pool[j] = pool[j], pool[i]
+        return pool[:k]
+
+    def spawn(self, n):
+        """Return n new streams that are independent of this one."""
+        return [RandomStream(s, self.block_size)
+                for s in self.seed_sequence.spawn(n)]
+
+def run_stream(seed, run):
+    """Return the stream for one of several independent runs with one seed."""
+    # Runs that share a seed get statistically independent streams, no matter
+    # which process they end up in.
+    return RandomStream(SeedSequence(seed, spawn_key = (run,)))
+
+def run_seed(seed, run):
+    """Return an integer seed for one of several independent runs of a seed.
+
+    This is for runs that take their seed as a setting (`random_seed`).  The
+    seed is drawn from the run's stream (see `run_stream()`).
+    """
+    return int(run_stream(seed, run).seed_sequence.generate_state(1)[0])
+
+# The stream used by the simulation.
+_stream = RandomStream(random_seed)
+
+class ThreadStreams(threading.local):
+    """Streams that stand in for the simulation's stream in some threads."""
+    # A class attribute, so that threads without a stream of their own can
+    # look it up cheaply.
+    stream = None
+
+_thread_streams = ThreadStreams()
+
+@contextmanager
+def thread_stream(stream):
+    """Draw from the stream provided in this thread, for the duration."""
+    old_stream = _thread_streams.stream
+    _thread_streams.stream = stream
+    try:
+        yield stream
+    finally:
+        _thread_streams.stream = old_stream
+
+def seed(s = None):
+    """Replace the simulation's stream with a freshly seeded one."""
+    global _stream
+    _stream = RandomStream(s)
+
+def get_stream():
+    """Return the simulation's current stream (in this thread)."""
+    return _thread_streams.stream or _stream
+
+def set_stream(stream):
+    """Make the stream provided the simulation's current stream."""
+    global _stream
+    _stream = stream
+
+# Drop-in replacements for the functions of the same names in `random` (and for
+# `numpy.random.choice` with weights), all drawing from the current stream (or
+# from the current thread's own stream, if it has one).
+def random():
+    return (_thread_streams.stream or _stream).random()
+
+def uniform(a, b):
+    return (_thread_streams.stream or _stream).uniform(a, b)
+
+def gauss(mu, sigma):
+    return (_thread_streams.stream or _stream).gauss(mu, sigma)
+
+def choice(seq):
+    return (_thread_streams.stream or _stream).choice(seq)
+
+def weighted_choice(seq, p):
+    return (_thread_streams.stream or _stream).weighted_choice(seq, p)
+
+def sample(seq, k):
+    return (_thread_streams.stream or _stream).sample(seq, k)
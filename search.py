@@ -0,0 +1,147 @@
+"""Search the parameter space for settings that produce final devoicing.
+
+Usage:
+    python search.py [--configs N] [--min-iterations N] [--max-iterations N]
+                     [--eta N] [--workers N] [--seed N] [--dir DIR]
+                     [--param NAME=LOW:HIGH ...] [--set NAME=VALUE ...]
+
+Many configurations are sampled at random from the parameter ranges and run for
+a few iterations.  Only the most promising third (or 1/eta) of them are then
+continued, from where they left off, for eta times as many iterations, and so
+on (successive halving) until the survivors reach the full number of
+iterations.  Configurations are scored by `outcomes.devoicing_outcome()`.
+"""
+
+import argparse, json, os
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from time import perf_counter
+import rng
+from outcomes import devoicing_outcome
+from log_utils import load_checkpoint, save_checkpoint
+from simulation import configure, parse_setting, run_simulation, run_info
+
+# The parameters searched by default, and their ranges.
+default_space = {'probability_of_bias': (0, 1),
+                 'paradigm_weight': (0, 1),
+                 'probability_of_esp': (0, 1)}
+
+def sample_configurations(n, space, seed, fixed = None):
+    """Return n configurations drawn uniformly from the parameter space."""
+    stream = rng.RandomStream(seed)
+    configs = []
+    for i in range(n):
+        parameters = dict(fixed or {})
+        for name in sorted(space):
+            low, high = space[name]
+            parameters[name] = round(stream.uniform(low, high), 3)
+        configs.append({'id': i,
+                        'seed': rng.run_seed(seed, i),
+                        'parameters': parameters})
+    return configs
+
+def checkpoint_file(directory, config):
+    """Return the name of the file a configuration's run is saved in."""
+    return os.path.join(directory, 'config_{}.pickle'.format(config['id']))
+
+def advance(config, checkpoint, target_iterations):
+    """Continue a configuration's run up to the target number of iterations.
+
+    Return the outcome of the run so far.
+    """
+    configure(**dict(config['parameters'],
+                     random_seed = config['seed'],
+                     iterations = target_iterations,
+                     logging_setting = False,
+                     telemetry_output = None))
+    # Pick up where the last rung left off, if there was one.
+    state = load_checkpoint(checkpoint)
+    start = perf_counter()
+    a1, a2 = run_simulation(quiet = True, agents = state['agents'],
+                            first_iteration = state['iterations'] + 1)
+    seconds = perf_counter() - start
+    # Save the run so that the next rung can continue it.
+    save_checkpoint(checkpoint, (a1, a2), run_info['iterations_run'])
+    outcome = devoicing_outcome([a1, a2])
+    return dict(outcome, id = config['id'],
+                iterations = run_info['iterations_run'], seconds = seconds)
+
+def rung_budgets(min_iterations, max_iterations, eta):
+    """Return the number of iterations each rung runs its survivors up to."""
+    budgets = []
+    budget = min_iterations
+    while budget < max_iterations:
+        budgets.append(budget)
+        budget *= eta
+    budgets.append(max_iterations)
+    return budgets
+
+def successive_halving(configs, directory, min_iterations, max_iterations,
+                       eta = 3, workers = None):
+    """Run the configurations, keeping the best 1/eta at each rung.
+
+    Return the outcomes of every rung.
+    """
+    os.makedirs(directory, exist_ok = True)
+    by_id = {config['id']: config for config in configs}
+    survivors = list(configs)
+    rungs = []
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        for r, budget in enumerate(rung_budgets(min_iterations, max_iterations,
+                                                eta)):
+            futures = [pool.submit(advance, config,
+                                   checkpoint_file(directory, config), budget)
+                       for config in survivors]
+            outcomes = sorted((f.result() for f in futures),
+                              key = lambda o: (-o['score'], o['id']))
+            rungs.append({'rung': r, 'iterations': budget,
+                          'outcomes': outcomes})
+            print('Rung {}: {} configurations at {} iterations; best score '
+                  '{:.3f}'.format(r, len(outcomes), budget,
+                                  outcomes[0]['score']))
+            # Keep the most promising configurations for the next rung.
+            keep = max(1, ceil(len(outcomes) / eta))
+            survivors = [by_id[o['id']] for o in outcomes[:keep]]
+    return rungs
+
+def parse_range(text):
+    """Parse a NAME=LOW:HIGH command-line argument."""
+    name, value_range = text.split('=')
+    low, high = value_range.split(':')
+    return name, (float(low), float(high))
+
+def main():
+    """Run a search from the command line."""
+    parser = argparse.ArgumentParser(description = 'Search for settings that '
+                                     'produce final devoicing.')
+    parser.add_argument('--configs', type = int, default = 27)
+    parser.add_argument('--min-iterations', type = int, default = 100)
+    parser.add_argument('--max-iterations', type = int, default = 3000)
+    parser.add_argument('--eta', type = int, default = 3)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--dir', default = 'search_runs')
+    parser.add_argument('--param', action = 'append', default = [],
+                        type = parse_range,
+                        help = 'search NAME between LOW and HIGH')
+    parser.add_argument('--set', action = 'append', default = [],
+                        type = parse_setting,
+                        help = 'fix NAME at VALUE in every configuration')
+    args = parser.parse_args()
+    space = dict(args.param) or default_space
+    configs = sample_configurations(args.configs, space, args.seed,
+                                    dict(args.set))
+    rungs = successive_halving(configs, args.dir, args.min_iterations,
+                               args.max_iterations, args.eta, args.workers)
+    with open(os.path.join(args.dir, 'search_results.json'), 'w') as out_file:
+        json.dump({'space': space, 'configs': configs, 'rungs': rungs},
+                  out_file, indent = 1)
+    print()
+    by_id = {config['id']: config for config in configs}
+    for outcome in rungs[-1]['outcomes']:
+        print('{:.3f}  devoiced = {!s:<5}  {}'.format(outcome['score'],
+              outcome['devoiced'],
+              json.dumps(by_id[outcome['id']]['parameters'])))
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,11 @@
-from random import choice, uniform, gauss
+from rng import choice, uniform, gauss
 from statistics import mean
-from nltk import FreqDist
 from math import copysign
-from numpy.random import choice as wchoice
+from collections import namedtuple, Counter
+from rng import weighted_choice as wchoice
 from numpy import arange
-from pyqt_fit import kde
+from backends import get_backend
+from profiling import count
 from parameters import *
  
 # I really should have made a class for features.  Alas, inertia has won.
@@ -38,6 +39,10 @@ all_segments = {'p': {'type': 'C',
                 'i': {'type': 'V',
                       'features': {'height': 'high', 'backness': 'front'}}}
 
+# A pair of parallel arrays of feature values and their weights.  Anywhere a
+# list of (value, weight) tuples is accepted, one of these can be used instead.
+WeightedValues = namedtuple('WeightedValues', ['values', 'weights'])
+
 def feature_type(feature):
     """Determine whether the feature is categorical or continuous."""
     if feature in all_features:
@@ -178,7 +183,7 @@ def get_common_values(cloud, feature, position = None, possible_values = None):
         if f_type == 'categorical':
             # Find all values that are tied for the most frequent and return
             # them.
-            value_counts = FreqDist(value_list)
+            value_counts = Counter(value_list)
             top_values = {v for v in value_counts
                           if value_counts[v] ==\
                           max(value_counts.values())}
@@ -209,11 +214,26 @@ def feature_distance(feat, val1, val2):
         dist = (val1 - val2) / (frange[-1] - frange[0])
         return dist
 
+def split_weighted_values(weighted_values):
+    """Return the values and the weights of a weighted list separately."""
+    if isinstance(weighted_values, WeightedValues):
+        return weighted_values
+    return WeightedValues([v for v, w in weighted_values],
+                          [w for v, w in weighted_values])
+
+def sum_of_weights(weighted_values):
+    """Return the sum of the weights of a weighted list."""
+    if isinstance(weighted_values, WeightedValues):
+        return weighted_values.weights.sum()
+    return sum(w for v, w in weighted_values)
+
 def density_maxima(feature, weighted_values):
     """Return the maxima of a KDE based on the values provided."""
-    kde_est = kde.KDE1D([v for v, w in weighted_values],
-                        weights = [w for v, w in weighted_values],
-                        bandwidth = kde_bandwidth)
+    count('density_maxima')
+    values, weights = split_weighted_values(weighted_values)
+    kde_est = get_backend('kde').KDE1D(values,
+                                       weights = weights,
+                                       bandwidth = kde_bandwidth)
     xs = arange(all_features[feature]['range'][0],
                 all_features[feature]['range'][-1],
                 kde_resolution).tolist()
@@ -224,6 +244,20 @@ def density_maxima(feature, weighted_values):
     max_coords = [(x, y) for x, y, m in zip(xs, ys, maxima) if m]
     return max_coords
 
+def feature_labels(feature):
+    """Return the values (or category labels) of a feature, in code order."""
+    # Categorical values are numbered in alphabetical order; the category
+    # labels of continuous features, in the order of their ranges.
+    if feature_type(feature) == 'categorical':
+        return sorted(all_features[feature]['values'])
+    return list(all_features[feature]['values'])
+
+# Integer codes for feature values, so that running counts of them (see
+# `prototypes.py`) can be kept in lists.
+label_values = {f: feature_labels(f) for f in all_features}
+label_codes = {f: {v: code for code, v in enumerate(label_values[f])}
+               for f in all_features}
+
 class Segment:
     """A class for consonants and vowels"""
     
@@ -291,8 +325,10 @@ class Segment:
     
     def possible_features(self):
         """Return possible features of the Segment, based on its type."""
-        return {f for f in all_features
-                if all_features[f]['type'] == self.seg_type}
+        # Keep the order in which the features are listed, so that random values
+        # are drawn in the same order every time.
+        return [f for f in all_features
+                if all_features[f]['type'] == self.seg_type]
     
     def get_feature_value(self, feature, convert_to_categorical = False):
         """Return value of specified feature for this Segment."""
@@ -363,20 +399,20 @@ class Segment:
             # chosen value is compatible with other features of this Segment.
             if f_type == 'categorical':
                 value_options = self.contingent_possible_values(feature)
-                self.features[feature] = choice(list(value_options))
+                self.features[feature] = choice(sorted(value_options))
             # Choose a random value in the appropriate range for continuous
             # features.  Make sure the chosen value is compatible with other
             # features of this Segment.
             elif f_type == 'continuous':
                 value_options = self.contingent_possible_values(feature)
-                value_choice = choice(list(value_options))
+                value_choice = choice(sorted(value_options))
                 f_range = category_to_range(feature, value_choice)
                 self.features[feature] = uniform(f_range[0], f_range[1])
         else:
             raise FeatureNotPossibleError(feature)
     
     def entrench_feature(self, feature, weighted_values, top_value,
-                         max_movement):
+                         max_movement, maxima = None):
         """Perturb a feature based on the values provided."""
         if all_features[feature]['type'] == self.seg_type:
             f_type = feature_type(feature)
@@ -392,7 +428,7 @@ class Segment:
                     max_count = max(val_counts.values())
                     top_vals = {val for val in val_counts
                                 if val_counts[val] == max_count}
-                    self.features[feature] = choice(list(top_vals))
+                    self.features[feature] = choice(sorted(top_vals))
                 # Otherwise, choose a value at random, with more heavily
                 # weighted values more likely to be chosen.
                 else:
@@ -406,11 +442,12 @@ class Segment:
             # Entrench continuous features.
             elif f_type == 'continuous':
                 top_val = self.features[feature]
-                total_weights = sum(w for v, w in weighted_values)
+                total_weights = sum_of_weights(weighted_values)
                 if total_weights > 0:
                     # Get the local maxima of a KDE based on the collected
-                    # values of the feature.
-                    maxima = density_maxima(feature, weighted_values)
+                    # values of the feature, unless they were provided.
+                    if maxima is None:
+                        maxima = density_maxima(feature, weighted_values)
                     # If the user specified that the top value is to be used,
                     # find the global maximum.
                     if top_value:
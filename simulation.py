@@ -1,17 +1,63 @@
 from wordform import WordForm, cases
 from agent import Agent
+from pool import ExemplarPool
 from segment import Segment
 from log_utils import log_state
-from random import gauss
+from rng import gauss
 from parameters import *
+import rng
+import parameters
+from profiling import profiler
+from telemetry import ProgressReporter
+from convergence import ConvergenceMonitor
+from utils import informativity_tracker
+import backends
+import catalogue
+from time import perf_counter
+import log_utils
+from collections import namedtuple
+from contextlib import contextmanager
+import ast, sys, os
 
-num_lemmas = 3
-lemmas = range(1, num_lemmas + 1)
+def configure(**settings):
+    """Override settings from `parameters.py` in every module that uses them."""
+    for name in settings:
+        if not hasattr(parameters, name):
+            raise ParameterNotFoundError(name)
+    # Every module in this directory that has imported the settings has its own
+    # copy of them; update all of these copies.
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in list(sys.modules.values()):
+        module_file = getattr(module, '__file__', None)
+        if module_file is not None and \
+           os.path.dirname(os.path.abspath(module_file)) == here:
+            for name in settings:
+                if name in module.__dict__:
+                    setattr(module, name, settings[name])
+
+def parse_setting(text):
+    """Parse a NAME=VALUE command-line argument."""
+    name, value = text.split('=', 1)
+    return name, ast.literal_eval(value)
+
+@contextmanager
+def configured(**settings):
+    """Override settings (see `configure()`) for the length of a `with` block.
+
+    The settings are put back as they were when the block is left.
+    """
+    old_settings = {name: getattr(parameters, name) for name in settings
+                    if hasattr(parameters, name)}
+    configure(**settings)
+    try:
+        yield
+    finally:
+        configure(**old_settings)
 
 def initialize_agent(agent):
     """Seed an agent with initial exemplars."""
     agent.timestep = 0
-    lemma_shapes = ['CVC', 'CVC']
+    lemma_shapes = ['CVC'] * num_lemmas
     # For each case,
     for case in cases:
         # fill the cloud with initial exemplars for each lemma shape,
@@ -22,9 +68,11 @@ def initialize_agent(agent):
         for wf in wfs:
             for (pos, seg) in enumerate(wf.segments):
                 if seg.seg_type == 'C':
-                    if wf.lemma == 1:
+                    # Odd-numbered lemmas start out voiced; even-numbered
+                    # lemmas start out voiceless.
+                    if wf.lemma % 2 == 1:
                         seg.features['vot'] = gauss(25, 5)
-                    elif wf.lemma == 2:
+                    else:
                         seg.features['vot'] = gauss(75, 5)
         # and add a suffix if thise case is supposed to have one.
         if len(cases[case]['suffix']) == 1:
@@ -32,47 +80,206 @@ def initialize_agent(agent):
                 wf.add_suffix(cases[case]['suffix'])
         agent.add_exemplars(wfs)
 
-# Initialize two agents, log them to a file, and print out their initial
-# exemplars.
-a1 = Agent(1)
-initialize_agent(a1)
-log_state(a1)
-print()
-print('*** AGENT 1 ***')
-a1.print_exemplars()
-a2 = Agent(2)
-initialize_agent(a2)
-log_state(a2)
-print('*** AGENT 2 ***')
-a2.print_exemplars()
-
-# Run the simulation.
-for i in range(1, iterations + 1):
-    if i % 200 == 0:
-        print(i)
-    # Agent 1 produces a word and Agent 2 stores it.  Log what happened.
-    a2.store(a1.produce(paradigms = paradigm_setting,
-                        bias = bias_setting,
-                        informativity = informativity_setting,
-                        categorization = categorization_setting,
-                        unique_base = unique_base_setting),
-             prob_esp = probability_of_esp,
-             categorization = categorization_setting)
-    a2.timestep += 1
-    log_state(a2)
-    # Agent 2 produces a word and Agent 1 stores it.  Log what happened.
-    a1.store(a2.produce(paradigms = paradigm_setting,
-                        bias = bias_setting,
-                        informativity = informativity_setting,
-                        categorization = categorization_setting,
-                        unique_base = unique_base_setting),
-             prob_esp = probability_of_esp,
-             categorization = categorization_setting)
-    a1.timestep += 1
-    log_state(a1)
-
-print()
-print('*** AGENT 1 ***')
-a1.print_exemplars()
-print('*** AGENT 2 ***')
-a2.print_exemplars()
+def interact(speaker, listener, k = 1):
+    """Have the speaker produce k words and the listener store them.
+
+    Return the speaker's productions.
+    """
+    # Produce and store a single word.
+    if k == 1:
+        productions = [speaker.produce(paradigms = paradigm_setting,
+                                       bias = bias_setting,
+                                       informativity = informativity_setting,
+                                       categorization = categorization_setting,
+                                       unique_base = unique_base_setting)]
+        listener.store(productions[0],
+                       prob_esp = probability_of_esp,
+                       categorization = categorization_setting)
+    # Produce and store a whole round of words at once.
+    else:
+        productions = speaker.produce_round(k,
+                                paradigms = paradigm_setting,
+                                bias = bias_setting,
+                                informativity = informativity_setting,
+                                categorization = categorization_setting,
+                                unique_base = unique_base_setting)
+        listener.store_round(productions,
+                             prob_esp = probability_of_esp,
+                             categorization = categorization_setting)
+    listener.timestep += k
+    return productions
+
+# Information about the most recent run: how many iterations it ran and, if it
+# stopped early, why.
+run_info = dict()
+
+# The events of a run.  An Interaction is one agent speaking to the other (in
+# an iteration, or a round of iterations, that ends with the one given).  A
+# State is the two agents after an iteration (or before the first one).
+Interaction = namedtuple('Interaction', ['iteration', 'speaker', 'listener',
+                                         'productions', 'seconds'])
+State = namedtuple('State', ['iteration', 'agents'])
+
+def simulate(config = None, agents = None, first_iteration = 1,
+             state_interval = 1):
+    """Run the simulation, yielding its events as they happen.
+
+    Yield a State before the first iteration, an Interaction after each
+    interaction, and a State at least every `state_interval` iterations and
+    after the last one.  States hold the agents themselves, which go on
+    changing as the run continues, so copy them to keep them.  The run stops
+    as soon as its events stop being consumed.
+
+    `config` overrides settings from `parameters.py` (see `configure()`) until
+    the run ends or is closed; the settings are then put back.  Only one run
+    can go on at a time, since runs share the random stream (see `rng`) and
+    `run_info`.
+
+    To continue an earlier run, pass in its two agents and the number of the
+    first iteration still to be run (and restore its random stream first).
+    """
+    with configured(**(config or {})):
+        if agents is None:
+            # Seed the simulation's random numbers and initialize two agents
+            # (sharing a pool of exemplars, if they're supposed to).
+            rng.seed(random_seed)
+            pool = ExemplarPool() if shared_pool_setting else None
+            a1 = Agent(1, pool = pool)
+            initialize_agent(a1)
+            a2 = Agent(2, pool = pool)
+            initialize_agent(a2)
+        else:
+            a1, a2 = agents
+        informativity_tracker.reset()
+        backends.reset_usage()
+        run_info.clear()
+        # Record the seed the run's random numbers came from (drawn from the
+        # operating system, if `random_seed` is None).
+        run_info['seed'] = rng.get_stream().seed_sequence.entropy
+        run_info['iterations_run'] = first_iteration - 1
+        completed = 'completed {} iterations'.format(iterations)
+        run_info['stop_reason'] = completed if first_iteration > iterations \
+                                  else 'stopped early by the caller'
+        yield State(first_iteration - 1, (a1, a2))
+        last_state = first_iteration - 1
+        # Run the simulation, `round_size` iterations at a time.  In each
+        # iteration, Agent 1 produces and Agent 2 stores, then the other way
+        # around.
+        for i in range(first_iteration, iterations + 1, round_size):
+            k = min(round_size, iterations + 1 - i)
+            profiler.iteration(i)
+            for speaker, listener in ((a1, a2), (a2, a1)):
+                start = perf_counter()
+                productions = interact(speaker, listener, k)
+                yield Interaction(i + k - 1, speaker, listener, productions,
+                                  perf_counter() - start)
+            run_info['iterations_run'] = i + k - 1
+            if i + k - 1 == iterations:
+                run_info['stop_reason'] = completed
+            if i + k - 1 - last_state >= state_interval or \
+               i + k - 1 == iterations:
+                last_state = i + k - 1
+                yield State(i + k - 1, (a1, a2))
+
+def record_state(agent):
+    """Log the Agent's state, if logging is turned on."""
+    if logging_setting:
+        log_state(agent)
+
+def run_simulation(quiet = False, agents = None, first_iteration = 1,
+                   should_stop = None):
+    """Run the simulation and return the two agents.
+
+    To continue an earlier run, pass in its two agents and the number of the
+    first iteration still to be run (and restore its random stream first).
+    `should_stop` is called with the number of each iteration as it finishes;
+    if it returns anything but None, the run stops there, for that reason.
+    """
+    start = perf_counter()
+    if profiling_setting:
+        profiler.reset()
+        profiler.enable(profile_window, profile_file)
+    # Report progress periodically (but not to the terminal if the run is
+    # supposed to be quiet).
+    reporter = None
+    if telemetry_output is not None and \
+       not (quiet and telemetry_output == 'stderr'):
+        reporter = ProgressReporter(iterations, telemetry_interval,
+                                    telemetry_output, log_utils.log_file_name,
+                                    first_iteration - 1)
+    monitor = None
+    if convergence_setting:
+        monitor = ConvergenceMonitor()
+    for event in simulate(agents = agents, first_iteration = first_iteration):
+        # Log each interaction's listener.
+        if isinstance(event, Interaction):
+            record_state(event.listener)
+            if reporter is not None:
+                reporter.record_interaction(event.speaker.agent_id,
+                                            event.seconds)
+            continue
+        a1, a2 = event.agents
+        # Log the new agents, and print out their initial exemplars.
+        if event.iteration == first_iteration - 1:
+            if agents is None:
+                record_state(a1)
+                record_state(a2)
+                if not quiet:
+                    print()
+                    print('*** AGENT 1 ***')
+                    a1.print_exemplars()
+                    print('*** AGENT 2 ***')
+                    a2.print_exemplars()
+            continue
+        if reporter is not None:
+            reporter.iteration_done(event.iteration)
+        # Stop if the clouds have settled.
+        if monitor is not None and monitor.update(event.iteration, [a1, a2]):
+            run_info['stop_reason'] = monitor.stop_reason
+            if not quiet:
+                print('Stopping early: ' + monitor.stop_reason)
+            break
+        # Stop if the caller wants to.
+        if should_stop is not None:
+            reason = should_stop(event.iteration)
+            if reason is not None:
+                run_info['stop_reason'] = reason
+                break
+    if not quiet:
+        print()
+        print('*** AGENT 1 ***')
+        a1.print_exemplars()
+        print('*** AGENT 2 ***')
+        a2.print_exemplars()
+    # Report how uncertain any estimated informativity weights were.
+    if informativity_sample_size is not None or \
+       informativity_target_ci is not None:
+        run_info['informativity'] = informativity_tracker.summary()
+        if not quiet:
+            print('Estimated informativity: ' +
+                  ', '.join('{} = {}'.format(k, v) for k, v in
+                            sorted(run_info['informativity'].items())))
+    # Record which of the optional backends the run needed.
+    run_info['backends'] = backends.backends_used()
+    if not quiet:
+        print('Backends used: ' + (', '.join(run_info['backends']) or 'none'))
+    if profiling_setting:
+        profiler.report()
+        profiler.disable()
+    run_info['seconds'] = perf_counter() - start
+    # Add the run to the catalogue, if there is one, and describe it next to
+    # its log (so that it can be added to another catalogue later).
+    if catalogue_file is not None:
+        record = catalogue.describe_run([a1, a2], log_utils.log_file_name
+                                        if logging_setting else None, run_info)
+        if logging_setting:
+            catalogue.write_meta(record)
+        catalogue.add_run(catalogue_file, record)
+    return a1, a2
+
+class ParameterNotFoundError(Exception):
+    """Exception raised when a setting isn't defined in `parameters.py`."""
+    pass
+
+if __name__ == '__main__':
+    run_simulation()
@@ -0,0 +1,142 @@
+import os, sys
+from collections import defaultdict
+from time import perf_counter
+from log_utils import atomic_write
+from profiling import percentile
+
+def resident_memory():
+    """Return the resident memory of this process in bytes (None if unknown)."""
+    # On Linux, the current resident set size is in /proc.
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    # Elsewhere, fall back on the peak resident set size.
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS reports bytes; other systems report kilobytes.
+        if sys.platform == 'darwin':
+            return peak
+        return peak * 1024
+    except (ImportError, OSError):
+        return None
+
+def format_duration(seconds):
+    """Return a duration in a compact human-readable form."""
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return '{}h{:02}m'.format(seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return '{}m{:02}s'.format(seconds // 60, seconds % 60)
+    return '{}s'.format(seconds)
+
+class ProgressReporter:
+    """Periodic reports of a run's throughput, latency, and resource use."""
+
+    def __init__(self, total_iterations, interval = 200, output = 'stderr',
+                 log_file = None, start_iteration = 0):
+        """Initialize a reporter.
+
+        A report is made every `interval` iterations.  If `output` is 'stderr',
+        reports are printed there; otherwise `output` is the name of a metrics
+        file that is rewritten with the latest values after every report.
+        `log_file` is the simulation's log, whose size is reported.  A run that
+        continues an earlier one starts after `start_iteration`.
+        """
+        self.total_iterations = total_iterations
+        self.interval = interval
+        self.output = output
+        self.log_file = log_file
+        self.start_time = perf_counter()
+        self.window_start_time = self.start_time
+        self.start_iteration = start_iteration
+        self.window_start_iteration = start_iteration
+        self.last_reported = start_iteration
+        self.latencies = defaultdict(list)
+
+    def record_interaction(self, agent_id, seconds):
+        """Record how long one of the agent's interactions took."""
+        self.latencies[agent_id].append(seconds)
+
+    def iteration_done(self, i):
+        """Note that iteration i is finished; report if it's time."""
+        if i // self.interval > self.last_reported // self.interval or \
+           i == self.total_iterations:
+            self.report(i)
+
+    def metrics(self, i):
+        """Return the current metrics."""
+        now = perf_counter()
+        elapsed = now - self.start_time
+        window_elapsed = now - self.window_start_time
+        window_iterations = i - self.window_start_iteration
+        metrics = {'iteration': i,
+                   'total_iterations': self.total_iterations,
+                   'elapsed_seconds': elapsed,
+                   'iterations_per_second': (i - self.start_iteration) / elapsed
+                                            if elapsed > 0 else 0,
+                   'window_iterations_per_second':
+                       window_iterations / window_elapsed
+                       if window_elapsed > 0 else 0,
+                   'resident_memory_bytes': resident_memory(),
+                   'log_bytes': None}
+        # Estimate the time left from the recent rate, since runs can slow down
+        # as the clouds change.
+        rate = metrics['window_iterations_per_second'] or \
+               metrics['iterations_per_second']
+        metrics['eta_seconds'] = (self.total_iterations - i) / rate \
+                                 if rate > 0 else None
+        if self.log_file is not None and os.path.exists(self.log_file):
+            metrics['log_bytes'] = os.path.getsize(self.log_file)
+        for agent_id in sorted(self.latencies):
+            latencies = sorted(self.latencies[agent_id])
+            if len(latencies) > 0:
+                for p in (50, 90, 99):
+                    key = 'agent{}_latency_p{}_seconds'.format(agent_id, p)
+                    metrics[key] = percentile(latencies, p)
+        return metrics
+
+    def report(self, i):
+        """Emit a report of the metrics, then start a new window."""
+        metrics = self.metrics(i)
+        if self.output == 'stderr':
+            self.print_report(metrics)
+        else:
+            self.write_metrics(metrics)
+        self.window_start_time = perf_counter()
+        self.window_start_iteration = i
+        self.last_reported = i
+        self.latencies = defaultdict(list)
+
+    def print_report(self, metrics):
+        """Print a one-line summary of the metrics to stderr."""
+        parts = ['{}/{}'.format(metrics['iteration'],
+                                metrics['total_iterations']),
+                 '{:.1f} it/s'.format(metrics['window_iterations_per_second'])]
+        if metrics['eta_seconds'] is not None:
+            parts.append('ETA ' + format_duration(metrics['eta_seconds']))
+        for key in sorted(metrics):
+            if key.endswith('_p50_seconds'):
+                agent = key.split('_')[0]
+                parts.append('{} {:.1f}/{:.1f}/{:.1f} ms'.format(agent,
+                    1000 * metrics[key],
+                    1000 * metrics[key.replace('p50', 'p90')],
+                    1000 * metrics[key.replace('p50', 'p99')]))
+        if metrics['resident_memory_bytes'] is not None:
+            parts.append('RSS {:.1f} MB'.format(
+                metrics['resident_memory_bytes'] / 2 ** 20))
+        if metrics['log_bytes'] is not None:
+            parts.append('log {:.1f} MB'.format(metrics['log_bytes'] / 2 ** 20))
+        print('  '.join(parts), file = sys.stderr)
+
+    def write_metrics(self, metrics):
+        """Replace the metrics file with the current metrics."""
+        # Write one `name value` pair per line (the Prometheus text format),
+        # replacing the old file only once it's written, so that a scraper
+        # never sees a half-written file.
+        with atomic_write(self.output) as metrics_file:
+            for key in sorted(metrics):
+                if metrics[key] is not None:
+                    metrics_file.write('sim_{} {}\n'.format(key, metrics[key]))
@@ -1,17 +1,27 @@
 from segment import Segment
 from segment import all_features, feature_type, get_common_values
 from copy import deepcopy
-from random import choice
-from math import floor, copysign, log
+from rng import choice, sample
+from math import floor, copysign, log, sqrt
 from statistics import mean
-from NaiveBayes import NaiveBayes
+import threading
+from backends import get_backend
+from profiling import count
 from parameters import *
 
-def cloud_form(cloud):
-    """Return a single surface form that represents the entire cloud."""
+def cloud_form(cloud = None, prototype = None):
+    """Return a single surface form that represents the entire cloud.
+
+    If the cloud's CloudPrototype is given instead, its running summaries are
+    used, without going through the cloud.
+    """
     # Start off with a WordForm; make its segments empty.  All exemplars in the
-    # cloud should have the same lemma and case; use the first one.
-    surface = deepcopy(cloud[0])
+    # cloud should have the same lemma and case; use the first one (or the
+    # prototype's).
+    if prototype is not None:
+        surface = deepcopy(prototype.exemplar)
+    else:
+        surface = deepcopy(cloud[0])
     for i, seg in enumerate(surface.segments):
         if i < 3:
             seg.features = {}
@@ -23,14 +33,19 @@ def cloud_form(cloud):
                 # Find the most common values of the feature in the cloud
                 # provided at the relevant position.  Make sure these values are
                 # compatible with the other features of the Segment.
-                value_options = get_common_values(cloud, feature, i,
-                                seg.contingent_possible_values(feature))
+                possible_values = seg.contingent_possible_values(feature)
+                if prototype is not None:
+                    value_options = prototype.common_values(i, feature,
+                                                            possible_values)
+                else:
+                    value_options = get_common_values(cloud, feature, i,
+                                                      possible_values)
                 # If there's at least one possible value, randomly select one of
                 # the possible values and set it as the new value of the
                 # feature.  Make sure the feature doesn't go outside the
                 # permitted range.
                 if len(value_options) > 0:
-                    seg.features[feature] = choice(list(value_options))
+                    seg.features[feature] = choice(sorted(value_options))
                     seg.enforce_range(feature)
     # Return a string representation of the WordForm.
     return str(surface)
@@ -67,6 +82,7 @@ def entropy(feature, values):
 def predict_lemma(wordform, cloud, positions = None, features = None,
                   method = 'bayes'):
     """Predict the lemma of the WordForm based on the data in the cloud."""
+    count('predict_lemma')
     # Choose the most likely lemma based on the calculated similarities between
     # the WordForm and exemplars in the cloud.
     if method == 'similarity':
@@ -89,7 +105,7 @@ def predict_lemma(wordform, cloud, positions = None, features = None,
         return decision
     # Do naive Bayesian classification.
     elif method == 'bayes':
-        model = NaiveBayes()
+        model = get_backend('naive_bayes')()
         for e in cloud:
             # Collect the attributes and label of the exemplar, and add the
             # result to the model's training data.
@@ -121,6 +137,8 @@ def predict_lemma(wordform, cloud, positions = None, features = None,
         wf_data = {'attributes': {'s' + str(i) + f: seg.features[f]
                                   for i, seg in enumerate(wordform.segments)
                                   if i < 3
+                                     and (positions == None
+                                          or i in positions)
                                   for f in seg.features
                                   if features is None or f in features}}
         # Predict the lemma of the WordForm to be categorized and return it.
@@ -146,3 +164,90 @@ def performance(cloud, positions = None, features = None, method = 'bayes'):
         return 0
     else:
         return feature_correct / len(feature_results)
+
+def performance_estimate(cloud, positions = None, features = None,
+                         method = 'bayes', sample_size = None,
+                         target_ci = None, min_sample_size = 10):
+    """Estimate the performance of the classifier from a sample of exemplars.
+
+    Return the estimated accuracy and the variance of the estimate.
+    """
+    # Hold out exemplars one at a time, in random order, until either
+    # `sample_size` exemplars have been tried or the 95% confidence interval of
+    # the estimate is narrower than +/- `target_ci`.
+    n_total = len(cloud)
+    if n_total == 0:
+        return 0, 0
+    if sample_size is None:
+        sample_size = n_total
+    correct = 0
+    n = 0
+    for i in sample(range(n_total), sample_size):
+        comp_cloud = cloud[:i] + cloud[i + 1:]
+        if predict_lemma(cloud[i], comp_cloud, positions = positions,
+                         features = features, method = method) == \
+           cloud[i].lemma:
+            correct += 1
+        n += 1
+        if target_ci is not None and n >= min_sample_size and \
+           1.96 * sqrt(estimate_variance(correct / n, n, n_total)) <= \
+           target_ci:
+            break
+    estimate = correct / n
+    return estimate, estimate_variance(estimate, n, n_total)
+
+def estimate_variance(p, n, n_total):
+    """Return the variance of a proportion estimated from a sample."""
+    # The sample is drawn without replacement, so apply the finite population
+    # correction; once every exemplar has been tried, the estimate is exact.
+    if n_total <= 1:
+        return 0
+    return p * (1 - p) / n * (n_total - n) / (n_total - 1)
+
+class InformativityTracker:
+    """Keep track of the uncertainty of estimated case weights."""
+    
+    def __init__(self):
+        # Weights can be estimated in several threads at once (see
+        # `entrenchment_threads`).
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """Forget everything recorded so far."""
+        self.estimates = 0
+        self.total_variance = 0
+        self.max_variance = 0
+        self.decisions = 0
+        self.unstable_decisions = 0
+    
+    def record(self, weights, variances, unique_base):
+        """Record one set of estimated weights and their variances."""
+        with self.lock:
+            self.estimates += len(weights)
+            self.total_variance += sum(variances.values())
+            self.max_variance = max([self.max_variance] +
+                                    list(variances.values()))
+            # With a unique base, the case with the highest weight wins.  The
+            # decision is unstable if the runner-up is within the 95%
+            # confidence interval of the difference between the two
+            # estimates.
+            if unique_base and len(weights) > 1:
+                ranked = sorted(weights, key = lambda c: weights[c],
+                                reverse = True)
+                first, second = ranked[0], ranked[1]
+                self.decisions += 1
+                if weights[first] - weights[second] <= \
+                   1.96 * sqrt(variances[first] + variances[second]):
+                    self.unstable_decisions += 1
+    
+    def summary(self):
+        """Return a summary of the recorded estimates."""
+        return {'estimates': self.estimates,
+                'mean_variance': self.total_variance / self.estimates
+                                 if self.estimates > 0 else 0,
+                'max_variance': self.max_variance,
+                'unique_base_decisions': self.decisions,
+                'unstable_decisions': self.unstable_decisions}
+
+informativity_tracker = InformativityTracker()
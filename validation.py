@@ -0,0 +1,431 @@
+"""Check that a faster version of the simulation behaves like the original.
+
+Usage:
+    python validation.py [--candidate NAME=VALUE ...] [--candidate-module MOD]
+                         [--set NAME=VALUE ...] [--trials N] [--replicates N]
+                         [--iterations N] [--checkpoints N] [--alpha P]
+                         [--effect D] [--seed N] [--output FILE]
+
+The candidate is the simulation with some settings changed (`--candidate`, for
+example `round_size=4` or `shared_pool_setting=True`) and/or some of its
+functions replaced by the ones with the same names in another module
+(`--candidate-module`; any of `density_maxima`, `predict_lemma`, `performance`,
+and `entropy`).  Two kinds of comparison are made:
+
+- Deterministic: the reference and candidate versions of a function are called
+  on the same inputs, with the same random numbers, and must give the same
+  results.  The cloud's pooled VOT buffers are always compared with collecting
+  the values from the cloud itself.
+- Statistical: both versions of the simulation are run on the same seeds, and
+  the VOT medians of every cloud across the replicates are compared at several
+  checkpoints with two-sample Kolmogorov-Smirnov tests.  Finding no difference
+  only counts as a pass if the tests could have found a difference of the size
+  given (`--effect`, as a Kolmogorov-Smirnov distance); otherwise the check is
+  underpowered, and the report says how many replicates it would need.
+
+A report of which checks passed, with the speedup of each, is printed and
+written to a JSON file.  The exit status is 1 if any check failed or was
+underpowered.
+"""
+
+import argparse, importlib, json, os, sys
+from contextlib import contextmanager
+from copy import deepcopy
+from math import exp, log, sqrt
+from time import perf_counter
+import numpy as np
+import parameters
+import rng
+import segment, utils
+from agent import Agent
+from outcomes import vot_medians
+from simulation import configured, initialize_agent, interact, run_simulation
+from simulation import parse_setting
+
+# The functions a candidate module can replace.
+replaceable = {'density_maxima': segment.density_maxima,
+               'predict_lemma': utils.predict_lemma,
+               'performance': utils.performance,
+               'entropy': utils.entropy}
+# The segment positions whose VOT medians are compared.
+compared_positions = (0, 2)
+# How close must numbers be to count as the same?
+tolerance = 1e-9
+
+@contextmanager
+def replaced(functions):
+    """Use the functions given in place of the originals, in every module."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    originals = []
+    # Every module that has imported one of the originals has its own
+    # reference to it; swap all of them.
+    for module in list(sys.modules.values()):
+        module_file = getattr(module, '__file__', None)
+        if module_file is not None and \
+           os.path.dirname(os.path.abspath(module_file)) == here:
+            for name in functions:
+                if module.__dict__.get(name) is replaceable[name]:
+                    originals.append((module, name))
+                    setattr(module, name, functions[name])
+    try:
+        yield
+    finally:
+        for module, name in originals:
+            setattr(module, name, replaceable[name])
+
+def same(a, b):
+    """Return whether two results are the same (up to rounding error)."""
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, (int, float, np.number)) and \
+       isinstance(b, (int, float, np.number)):
+        return abs(a - b) <= tolerance * max(1, abs(a), abs(b))
+    return a == b
+
+def matched_call(call, stream):
+    """Call the function with a copy of the random stream.
+
+    Return the result and how many seconds the call took.
+    """
+    rng.set_stream(deepcopy(stream))
+    start = perf_counter()
+    result = call()
+    return result, perf_counter() - start
+
+def cloud_vot_values(agent):
+    """Return the cloud's VOT values, collected from its exemplars."""
+    return [(s.features['vot'], 1)
+            for e in agent.exemplars
+            for p, s in enumerate(e.segments)
+            if p < 3 and 'vot' in s.features]
+
+def check_density_maxima(agent, listener, candidate):
+    """Return reference and candidate calls for the KDE maxima."""
+    reference = lambda: segment.density_maxima('vot', cloud_vot_values(agent))
+    if candidate is None:
+        buffer = agent._feature_buffers['vot']
+        return reference, lambda: segment.density_maxima(
+                                      'vot', buffer.weighted_values())
+    return reference, lambda: candidate('vot', cloud_vot_values(agent))
+
+def check_entrench_segments(agent, listener, candidate):
+    """Return reference and candidate calls for segment-level entrenchment."""
+    production = deepcopy(rng.choice(agent.exemplars))
+    def entrench(buffers):
+        wordform = deepcopy(production)
+        wordform.entrench_segments(agent.exemplars, buffers = buffers)
+        return [s.features for s in wordform.segments]
+    return lambda: entrench(None), lambda: entrench(agent._feature_buffers)
+
+def check_predict_lemma(agent, listener, candidate):
+    """Return reference and candidate calls for categorizing a production."""
+    production = deepcopy(rng.choice(agent.exemplars))
+    production.add_noise()
+    method = parameters.categorization_setting
+    return (lambda: utils.predict_lemma(production, listener.exemplars,
+                                        method = method),
+            lambda: candidate(production, listener.exemplars,
+                              method = method))
+
+def check_performance(agent, listener, candidate):
+    """Return reference and candidate calls for classifier performance."""
+    cloud = [e for e in agent.exemplars if e.case == 'abs']
+    method = parameters.categorization_setting
+    return (lambda: utils.performance(cloud, positions = [2],
+                                      features = ['vot'], method = method),
+            lambda: candidate(cloud, positions = [2], features = ['vot'],
+                              method = method))
+
+def check_entropy(agent, listener, candidate):
+    """Return reference and candidate calls for the entropy of VOT."""
+    values = [e.segments[2].features['vot'] for e in agent.exemplars]
+    return (lambda: utils.entropy('vot', values),
+            lambda: candidate('vot', values))
+
+# For each deterministic check: the function that sets it up, the name of the
+# function a candidate module can replace (if any), and whether the check has a
+# built-in candidate.  A check with no candidate is skipped.
+deterministic_checks = {'density_maxima': (check_density_maxima,
+                                           'density_maxima', True),
+                        'entrench_segments': (check_entrench_segments, None,
+                                              True),
+                        'predict_lemma': (check_predict_lemma,
+                                          'predict_lemma', False),
+                        'performance': (check_performance, 'performance',
+                                        False),
+                        'entropy': (check_entropy, 'entropy', False)}
+
+def run_deterministic_checks(candidates, trials, seed):
+    """Compare reference and candidate functions on the same inputs.
+
+    The inputs come from successive states of a short run, so that they cover
+    clouds as they change.
+    """
+    rng.seed(seed)
+    a1, a2 = Agent(1), Agent(2)
+    initialize_agent(a1)
+    initialize_agent(a2)
+    results = {name: {'trials': 0, 'mismatches': 0, 'reference_seconds': 0,
+                      'candidate_seconds': 0}
+               for name in deterministic_checks}
+    for t in range(trials):
+        for name in deterministic_checks:
+            setup, replaces, built_in = deterministic_checks[name]
+            candidate = candidates.get(replaces)
+            if candidate is None and not built_in:
+                continue
+            reference_call, candidate_call = setup(a1, a2, candidate)
+            stream = rng.get_stream()
+            reference_result, reference_seconds = matched_call(reference_call,
+                                                               stream)
+            after_reference = rng.get_stream()
+            candidate_result, candidate_seconds = matched_call(candidate_call,
+                                                               stream)
+            # Carry on from where the reference left the random stream.
+            rng.set_stream(after_reference)
+            result = results[name]
+            result['trials'] += 1
+            result['mismatches'] += not same(reference_result,
+                                             candidate_result)
+            result['reference_seconds'] += reference_seconds
+            result['candidate_seconds'] += candidate_seconds
+        # Move the clouds on before the next trial.
+        interact(a1, a2)
+        interact(a2, a1)
+    for name in results:
+        result = results[name]
+        result['skipped'] = result['trials'] == 0
+        result['passed'] = result['mismatches'] == 0
+        result['speedup'] = speedup(result['reference_seconds'],
+                                    result['candidate_seconds'])
+    return results
+
+def speedup(reference_seconds, candidate_seconds):
+    """Return how many times faster the candidate was."""
+    if candidate_seconds > 0:
+        return reference_seconds / candidate_seconds
+    return None
+
+def ks_test(x, y):
+    """Return the two-sample Kolmogorov-Smirnov statistic and its p-value."""
+    x, y = np.sort(x), np.sort(y)
+    both = np.concatenate([x, y])
+    # The largest gap between the two empirical distribution functions.
+    cdf_x = np.searchsorted(x, both, side = 'right') / len(x)
+    cdf_y = np.searchsorted(y, both, side = 'right') / len(y)
+    d = float(np.max(np.abs(cdf_x - cdf_y)))
+    # The asymptotic p-value, with Stephens's correction for small samples.
+    n = len(x) * len(y) / (len(x) + len(y))
+    lam = (sqrt(n) + .12 + .11 / sqrt(n)) * d
+    if lam < 1e-3:
+        return d, 1.0
+    p = 2 * sum((-1) ** (k - 1) * exp(-2 * k ** 2 * lam ** 2)
+                for k in range(1, 101))
+    return d, min(1.0, max(0.0, p))
+
+def detectable_ks_statistic(n, m, threshold):
+    """Return the smallest KS statistic that's significant at the threshold.
+
+    This is the smallest difference between samples of sizes n and m that
+    `ks_test()` can detect; if it's above 1, the test can't fail at all.
+    """
+    # Invert the first (dominant) term of the p-value's series.
+    n = n * m / (n + m)
+    lam = sqrt(-log(threshold / 2) / 2)
+    return lam / (sqrt(n) + .12 + .11 / sqrt(n))
+
+def replicates_needed(effect, threshold):
+    """Return how many replicates a KS test needs to detect the effect."""
+    n = 1
+    while detectable_ks_statistic(n, n, threshold) > effect:
+        n += 1
+    return n
+
+def checkpoint_iterations(iterations, checkpoints):
+    """Return the iterations after which the clouds are compared."""
+    return sorted({max(1, round(iterations * (c + 1) / checkpoints))
+                   for c in range(checkpoints)})
+
+def replicate_medians(settings, functions, replicates, iterations,
+                      checkpoints, seed):
+    """Run replicates of the simulation; return their VOT medians and time.
+
+    The result maps each checkpoint to a dictionary from (position, agent,
+    lemma, case) to the list of that cloud's medians across replicates.
+    """
+    medians = {c: dict() for c in checkpoints}
+    seconds = 0
+    with replaced(functions):
+        for r in range(replicates):
+            agents = None
+            first_iteration = 1
+            for c in checkpoints:
+                with configured(**dict(settings, random_seed = seed + r,
+                                       iterations = c)):
+                    start = perf_counter()
+                    agents = run_simulation(quiet = True, agents = agents,
+                                            first_iteration = first_iteration)
+                    seconds += perf_counter() - start
+                first_iteration = c + 1
+                for pos in compared_positions:
+                    cloud_medians = vot_medians(agents, pos)
+                    for key in cloud_medians:
+                        medians[c].setdefault((pos,) + key, []).\
+                            append(cloud_medians[key])
+    return medians, seconds
+
+def run_statistical_checks(reference_settings, candidate_settings,
+                           candidate_functions, replicates, iterations,
+                           checkpoints, alpha, effect, seed):
+    """Compare the distributions of the two versions' VOT medians."""
+    checkpoints = checkpoint_iterations(iterations, checkpoints)
+    reference, reference_seconds = replicate_medians(reference_settings, {},
+                                                     replicates, iterations,
+                                                     checkpoints, seed)
+    candidate, candidate_seconds = replicate_medians(
+        dict(reference_settings, **candidate_settings), candidate_functions,
+        replicates, iterations, checkpoints, seed)
+    tests = []
+    sizes = []
+    for c in checkpoints:
+        for key in sorted(set(reference[c]) | set(candidate[c])):
+            x = reference[c].get(key, [])
+            y = candidate[c].get(key, [])
+            if len(x) == 0 or len(y) == 0:
+                d, p = 1.0, 0.0
+            else:
+                d, p = ks_test(x, y)
+            position, agent_id, lemma, case = key
+            tests.append({'iteration': c, 'position': position,
+                          'agent': agent_id, 'lemma': lemma, 'case': case,
+                          'ks_statistic': d, 'p_value': p,
+                          'reference_median': float(np.median(x))
+                                              if len(x) > 0 else None,
+                          'candidate_median': float(np.median(y))
+                                              if len(y) > 0 else None})
+            sizes.append((max(1, len(x)), max(1, len(y))))
+    # Correct for the number of tests (Bonferroni).
+    threshold = alpha / max(1, len(tests))
+    for test, (n, m) in zip(tests, sizes):
+        test['passed'] = test['p_value'] >= threshold
+        test['detectable_d'] = detectable_ks_statistic(n, m, threshold)
+    # Finding no difference only means something if a difference of the size
+    # given could have been found (or if the runs were identical anyway).
+    identical = reference == candidate
+    detectable = max((test['detectable_d'] for test in tests), default = 0)
+    powered = identical or detectable <= effect
+    return {'replicates': replicates, 'checkpoints': checkpoints,
+            'alpha': alpha, 'threshold': threshold, 'effect': effect,
+            'detectable_d': detectable,
+            'replicates_needed': replicates_needed(effect, threshold),
+            'powered': powered, 'identical': identical,
+            'passed': powered and all(test['passed'] for test in tests),
+            'reference_seconds': reference_seconds,
+            'candidate_seconds': candidate_seconds,
+            'speedup': speedup(reference_seconds, candidate_seconds),
+            'tests': tests}
+
+def print_report(report):
+    """Print a summary of the report."""
+    def format_speedup(value):
+        return '{:6.2f}x'.format(value) if value is not None else '     - '
+    print('Deterministic checks')
+    for name, result in sorted(report['deterministic'].items()):
+        if result['skipped']:
+            print('  {:<18} skipped (no candidate)'.format(name))
+        else:
+            print('  {:<18} {}  {}  {} of {} trials differ'.format(name,
+                  'PASS' if result['passed'] else 'FAIL',
+                  format_speedup(result['speedup']), result['mismatches'],
+                  result['trials']))
+    statistical = report.get('statistical')
+    if statistical is not None:
+        failures = [t for t in statistical['tests'] if not t['passed']]
+        print('Statistical checks ({} replicates, {} tests, alpha {})'.format(
+              statistical['replicates'], len(statistical['tests']),
+              statistical['alpha']))
+        verdict = 'PASS' if statistical['passed'] else 'FAIL'
+        if len(failures) == 0 and not statistical['powered']:
+            verdict = 'UNDERPOWERED'
+        print('  {:<18} {}  {}  {}'.format('vot_medians', verdict,
+              format_speedup(statistical['speedup']),
+              'identical trajectories' if statistical['identical']
+              else '{} clouds differ'.format(len(failures))))
+        if not statistical['identical']:
+            print('    smallest detectable difference D = {:.3f} (must be at '
+                  'most {}); {} replicates needed'.format(
+                  statistical['detectable_d'], statistical['effect'],
+                  statistical['replicates_needed']))
+        for t in failures:
+            print('    iteration {iteration}, C{position}, agent {agent}, '
+                  'lemma {lemma}, {case}: D = {ks_statistic:.3f}, '
+                  'p = {p_value:.2g}'.format(**t))
+    print('PASS' if report['passed'] else 'FAIL')
+
+def validate(candidate_settings = None, candidate_module = None,
+             settings = None, trials = 20, replicates = 30, iterations = 300,
+             checkpoints = 3, alpha = .05, effect = .5, seed = 0):
+    """Compare the candidate with the reference; return the report."""
+    settings = dict(settings or {}, logging_setting = False,
+                    telemetry_output = None)
+    candidate_settings = candidate_settings or {}
+    candidate_functions = dict()
+    if candidate_module is not None:
+        module = importlib.import_module(candidate_module)
+        candidate_functions = {name: getattr(module, name)
+                               for name in replaceable
+                               if hasattr(module, name)}
+    with configured(**settings):
+        report = {'candidate_settings': candidate_settings,
+                  'candidate_module': candidate_module,
+                  'candidate_functions': sorted(candidate_functions),
+                  'settings': settings}
+        report['deterministic'] = run_deterministic_checks(candidate_functions,
+                                                           trials, seed)
+        passed = all(r['passed'] for r in report['deterministic'].values())
+        if replicates > 0:
+            report['statistical'] = run_statistical_checks(settings,
+                candidate_settings, candidate_functions, replicates,
+                iterations, checkpoints, alpha, effect, seed)
+            passed = passed and report['statistical']['passed']
+        report['passed'] = passed
+    return report
+
+def main():
+    """Validate a candidate from the command line."""
+    parser = argparse.ArgumentParser(description = 'Check that a faster '
+                                     'version of the simulation behaves like '
+                                     'the original.')
+    parser.add_argument('--candidate', action = 'append', default = [],
+                        type = parse_setting,
+                        help = 'a setting of the candidate (NAME=VALUE)')
+    parser.add_argument('--candidate-module', default = None,
+                        help = 'a module with replacement functions')
+    parser.add_argument('--set', action = 'append', default = [],
+                        type = parse_setting,
+                        help = 'a setting of both versions (NAME=VALUE)')
+    parser.add_argument('--trials', type = int, default = 20)
+    parser.add_argument('--replicates', type = int, default = 30)
+    parser.add_argument('--iterations', type = int, default = 300)
+    parser.add_argument('--checkpoints', type = int, default = 3)
+    parser.add_argument('--alpha', type = float, default = .05)
+    parser.add_argument('--effect', type = float, default = .5,
+                        help = 'the smallest difference between the VOT '
+                        'median distributions (as a KS distance) that the '
+                        'statistical check must be able to detect')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output', default = 'validation_report.json')
+    args = parser.parse_args()
+    report = validate(dict(args.candidate), args.candidate_module,
+                      dict(args.set), args.trials, args.replicates,
+                      args.iterations, args.checkpoints, args.alpha,
+                      args.effect, args.seed)
+    with open(args.output, 'w') as out_file:
+        json.dump(report, out_file, indent = 1)
+    print_report(report)
+    sys.exit(0 if report['passed'] else 1)
+
+if __name__ == '__main__':
+    main()
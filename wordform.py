@@ -1,10 +1,12 @@
 from segment import Segment
 from segment import all_features, feature_distance, get_common_values
-from segment import feature_type
-from utils import entropy, performance
+from segment import feature_type, density_maxima, sum_of_weights
+from utils import entropy, performance, performance_estimate
+from utils import informativity_tracker
 from copy import deepcopy
-from random import uniform, choice
-from numpy.random import choice as wchoice
+from concurrent.futures import ThreadPoolExecutor
+from rng import uniform, choice, get_stream, thread_stream
+from profiling import phase
 from parameters import *
 
 cases = {'abs': {'name': 'Absolutive',
@@ -12,6 +14,95 @@ cases = {'abs': {'name': 'Absolutive',
          'erg': {'name': 'Ergative',
                  'suffix': 'i'}}
 
+def case_weights(cloud, pos, feat, informativity, categorization, unique_base):
+    """Return the weight of each case for entrenchment within the paradigm."""
+    weights = dict()
+    # If informativity is measured via the entropy method, the weight of a case
+    # is proportional to the entropy of the feature across all lemmas of that
+    # case.
+    if informativity == 'entropy':
+        weights = {c: entropy(feat, [e.segments[pos].features[feat]
+                                     for e in cloud
+                                     if e.case == c])
+                   for c in cases}
+    # If informativity is measured via a classification algorithm, the weight
+    # of a case is proportional to the performance of the classifier on lemmas
+    # within that case using just the current feature.
+    elif informativity == 'classification':
+        if informativity_sample_size is None and \
+           informativity_target_ci is None:
+            weights = {c: performance([e
+                                       for e in cloud
+                                       if e.case == c],
+                                      positions = [pos],
+                                      features = [feat],
+                                      method = categorization)
+                       for c in cases}
+        # The performance can also be estimated from a sample of the cloud.
+        # Keep track of how uncertain the estimates are.
+        else:
+            estimates = {c: performance_estimate([e
+                                                  for e in cloud
+                                                  if e.case == c],
+                                    positions = [pos],
+                                    features = [feat],
+                                    method = categorization,
+                                    sample_size = informativity_sample_size,
+                                    target_ci = informativity_target_ci)
+                         for c in cases}
+            weights = {c: estimates[c][0] for c in cases}
+            informativity_tracker.record(weights,
+                                         {c: estimates[c][1] for c in cases},
+                                         unique_base)
+    # If informativity is not measured, set the weights of all cases to 1.
+    elif informativity == 'none':
+        weights = {c: 1
+                   for c in cases}
+    # If paradigms are required to have a unique base, the winner takes all the
+    # weight.
+    if unique_base:
+        max_weight = max(weights.values())
+        for c in weights:
+            if weights[c] < max_weight:
+                weights[c] = 0
+    return weights
+
+def cached(cache, key, compute, feature = None):
+    """Return compute(), reusing an earlier result stored in the cache."""
+    # Without a cache, just compute the result.  When the result is a set of
+    # weighted values for a feature, pair it with the KDE maxima of continuous
+    # features (which are only worth precomputing if they can be reused).
+    if cache is None:
+        if feature is None:
+            return compute()
+        return compute(), None
+    if not key in cache:
+        result = compute()
+        if feature is not None:
+            maxima = None
+            if feature_type(feature) == 'continuous':
+                maxima = []
+                if sum_of_weights(result) > 0:
+                    maxima = density_maxima(feature, result)
+            result = (result, maxima)
+        cache[key] = result
+    return cache[key]
+
+# The threads that work out entrenchment targets (see `entrenchment_threads`),
+# started when they're first needed.
+_thread_pool = None
+_thread_pool_size = 0
+
+def thread_pool(threads):
+    """Return a pool of the number of threads given, shared between calls."""
+    global _thread_pool, _thread_pool_size
+    if threads != _thread_pool_size:
+        if _thread_pool is not None:
+            _thread_pool.shutdown()
+        _thread_pool = ThreadPoolExecutor(max_workers = threads)
+        _thread_pool_size = threads
+    return _thread_pool
+
 class WordForm:
     """A class for wordforms (strings of Cs and Vs)"""
     
@@ -36,100 +127,202 @@ class WordForm:
         self.segments.append(Segment.new_segment(suffix))
     
     def entrench(self, cloud, paradigms, informativity, categorization,
-                 unique_base):
+                 unique_base, buffers = None, cache = None, streams = None):
         """Move the WordForm closer to the middle of various clouds."""
         self.entrench_word(cloud, paradigms, informativity, categorization,
-                           unique_base)
-        self.entrench_segments(cloud)
+                           unique_base, cache, streams)
+        with phase('entrench_segments'):
+            self.entrench_segments(cloud, buffers, cache)
     
     def entrench_word(self, cloud, paradigms, informativity, categorization,
-                      unique_base):
+                      unique_base, cache = None, streams = None):
         """Entrench at the level of the WordForm."""
-        # Entrench within the WordForm's own cloud.  Iterate over positions in
-        # the WordForm (up to three Segments).
+        if entrenchment_threads > 1:
+            with phase('entrench_word_threaded'):
+                self.entrench_word_threaded(cloud, paradigms, informativity,
+                                            categorization, unique_base, cache,
+                                            streams)
+            return
+        # Entrench within the WordForm's own cloud.
+        with phase('entrench_self'):
+            self.entrench_self(cloud, cache)
+        # Entrench within other clouds of the same paradigm.
+        if paradigms:
+            with phase('entrench_paradigm'):
+                self.entrench_paradigm(cloud, informativity, categorization,
+                                       unique_base, cache)
+    
+    def entrench_self(self, cloud, cache = None):
+        """Entrench within the WordForm's own cloud."""
+        # Iterate over positions in the WordForm (up to three Segments).
         for pos, seg in enumerate(self.segments):
             if pos < 3:
                 # Iterate over features.
                 for feat in seg.features:
                     if uniform(0, 1) < probability_of_analogy:
                         # Collect other values of the feature across the cloud.
-                        # Since this is the WordForm's own cloud, set all the
-                        # weights to 1.
-                        wv = [(e.segments[pos].features[feat], 1)
-                              for e in cloud
-                              if e.lemma == self.lemma
-                                 and e.case == self.case]
+                        wv, maxima = cached(cache,
+                                            ('self', self.lemma, self.case,
+                                             pos, feat),
+                                            lambda: self.own_values(cloud, pos,
+                                                                    feat),
+                                            feat)
                         # Entrench the segment based on these values.
                         seg.entrench_feature(feat, wv,
                                              top_value = self_top_value,
-                                             max_movement = self_max_movement)
-        # Entrench within other clouds of the same paradigm.
+                                             max_movement = self_max_movement,
+                                             maxima = maxima)
+    
+    def entrench_paradigm(self, cloud, informativity, categorization,
+                          unique_base, cache = None):
+        """Entrench within other clouds of the same paradigm."""
+        # Iterate over positions in the WordForm (up to three Segments).
+        for pos, seg in enumerate(self.segments):
+            if pos < 3:
+                # Iterate over features.
+                for feat in seg.features:
+                    if uniform(0, 1) < (probability_of_analogy *
+                                        paradigm_weight):
+                        # Get the weight for each case.
+                        with phase('informativity'):
+                            weights = cached(cache, ('weights', pos, feat),
+                                             lambda: case_weights(cloud, pos,
+                                                    feat, informativity,
+                                                    categorization,
+                                                    unique_base))
+                        # Collect other values of the feature across the
+                        # cloud, and pair them with their weights.
+                        wv, maxima = cached(cache,
+                                            ('paradigm', self.lemma,
+                                             self.case, pos, feat),
+                                            lambda: self.paradigm_values(
+                                                cloud, pos, feat, weights),
+                                            feat)
+                        # Entrench the segment based on these values.
+                        seg.entrench_feature(feat, wv,
+                                             top_value = paradigm_top_value,
+                                             max_movement =
+                                                 paradigm_max_movement,
+                                             maxima = maxima)
+    
+    def entrench_word_threaded(self, cloud, paradigms, informativity,
+                               categorization, unique_base, cache = None,
+                               streams = None):
+        """Entrench at the level of the WordForm, with targets in parallel.
+
+        The nth target draws its random numbers from the nth of the streams
+        given, which are spawned from the main stream when there aren't enough
+        of them (and kept for later productions).  So a seeded run gives the
+        same results with any number of threads above one, but not the
+        results of `entrench_word()` with one thread.
+        """
+        # The targets depend only on the cloud, not on each other, so decide
+        # which features get entrenched (in the order `entrench_self()` and
+        # `entrench_paradigm()` would), work out all their targets at once,
+        # then apply them in order.
+        targets = []
+        for pos, seg in enumerate(self.segments):
+            if pos < 3:
+                for feat in seg.features:
+                    if uniform(0, 1) < probability_of_analogy:
+                        targets.append(('self', pos, feat))
         if paradigms:
-            # Iterate over positions in the WordForm (up to three Segments).
             for pos, seg in enumerate(self.segments):
                 if pos < 3:
-                    # Iterate over features.
                     for feat in seg.features:
                         if uniform(0, 1) < (probability_of_analogy *
                                             paradigm_weight):
-                            # Get the weight for each case.
-                            weights = dict()
-                            # If informativity is measured via the entropy
-                            # method, the weight of a case is proportional to
-                            # the entropy of the feature across all lemmas of
-                            # that case.
-                            if informativity == 'entropy':
-                                weights = {c: entropy(feat, [e.segments[pos].\
-                                                             features[feat]
-                                                             for e in cloud
-                                                             if e.case == c])
-                                           for c in cases}
-                            # If informativity is measured via a classification
-                            # algorithm, the weight of a case is proportional to
-                            # the performance of the classifier on lemmas within
-                            # that case using just the current feature.
-                            elif informativity == 'classification':
-                                weights = {c: performance([e
-                                                           for e in cloud
-                                                           if e.case == c],
-                                                          positions = [pos],
-                                                          features = [feat],
-                                                        method = categorization)
-                                           for c in cases}
-                            # If informativity is not measured, set the weights
-                            # of all cases to 1.
-                            elif informativity == 'none':
-                                weights = {c: 1
-                                           for c in cases}
-                            # If paradigms are required to have a unique base,
-                            # the winner takes all the weight.
-                            if unique_base:
-                                max_weight = max(weights.values())
-                                for c in weights:
-                                    if weights[c] < max_weight:
-                                        weights[c] = 0
-                            # Collect other values of the feature across the
-                            # cloud, and pair them with their weights.
-                            wv = [(e.segments[pos].features[feat],
-                                   weights[e.case])
-                                  for e in cloud
-                                  if e.lemma == self.lemma
-                                     and e.case != self.case]
-                            # Entrench the segment based on these values.
-                            seg.entrench_feature(feat, wv,
-                                                 top_value = paradigm_top_value,
-                                           max_movement = paradigm_max_movement)
-    
-    def entrench_segments(self, cloud):
+                            targets.append(('paradigm', pos, feat))
+        # Give each target a stream of its own, so that the random numbers it
+        # uses (to sample exemplars for informativity estimates) don't depend
+        # on how the threads happen to be scheduled.  Streams go to targets by
+        # their place in the list, so they're only spawned once (not once per
+        # target).
+        if streams is None:
+            streams = []
+        if len(streams) < len(targets):
+            streams.extend(get_stream().spawn(len(targets) - len(streams)))
+        pool = thread_pool(entrenchment_threads)
+        futures = [pool.submit(self.entrenchment_target, stream, cloud, kind,
+                               pos, feat, informativity, categorization,
+                               unique_base, cache)
+                   for (kind, pos, feat), stream in zip(targets, streams)]
+        for (kind, pos, feat), future in zip(targets, futures):
+            wv, maxima = future.result()
+            if kind == 'self':
+                self.segments[pos].entrench_feature(feat, wv,
+                                            top_value = self_top_value,
+                                            max_movement = self_max_movement,
+                                            maxima = maxima)
+            else:
+                self.segments[pos].entrench_feature(feat, wv,
+                                            top_value = paradigm_top_value,
+                                            max_movement =
+                                                paradigm_max_movement,
+                                            maxima = maxima)
+    
+    def entrenchment_target(self, stream, cloud, kind, pos, feat,
+                            informativity, categorization, unique_base,
+                            cache = None):
+        """Return the values (and KDE maxima) to entrench a feature towards.
+
+        This runs in a thread of its own, drawing from the stream provided.
+        """
+        # Always work out the KDE maxima here, rather than leave them to the
+        # main thread; keep them in the shared cache if there is one.
+        if cache is None:
+            cache = dict()
+        # The phases are timed in each thread, so their times overlap.
+        with thread_stream(stream):
+            if kind == 'self':
+                with phase('entrench_self'):
+                    return cached(cache, ('self', self.lemma, self.case, pos,
+                                          feat),
+                                  lambda: self.own_values(cloud, pos, feat),
+                                  feat)
+            with phase('entrench_paradigm'):
+                with phase('informativity'):
+                    weights = cached(cache, ('weights', pos, feat),
+                                     lambda: case_weights(cloud, pos, feat,
+                                                          informativity,
+                                                          categorization,
+                                                          unique_base))
+                return cached(cache, ('paradigm', self.lemma, self.case, pos,
+                                      feat),
+                              lambda: self.paradigm_values(cloud, pos, feat,
+                                                           weights),
+                              feat)
+    
+    def own_values(self, cloud, pos, feat):
+        """Return values of the feature in the WordForm's own cloud."""
+        # Since this is the WordForm's own cloud, all the weights are 1.
+        return [(e.segments[pos].features[feat], 1)
+                for e in cloud
+                if e.lemma == self.lemma
+                   and e.case == self.case]
+    
+    def paradigm_values(self, cloud, pos, feat, weights):
+        """Return weighted values of the feature in the rest of the paradigm."""
+        return [(e.segments[pos].features[feat], weights[e.case])
+                for e in cloud
+                if e.lemma == self.lemma
+                   and e.case != self.case]
+    
+    def entrench_segments(self, cloud, buffers = None, cache = None):
         """Entrench at the level of the Segment."""
         # Iterate over features.
         for feat in all_features:
             if feature_type(feat) == 'continuous':
-                # Collect all values of the feature across the cloud.
-                values = [(s.features[feat], 1)
-                          for e in cloud
-                          for p, s in enumerate(e.segments)
-                          if p < 3 and feat in s.features]
+                # Collect all values of the feature across the cloud.  If the
+                # cloud's values are already pooled in buffers, use those.
+                if buffers is not None and feat in buffers:
+                    collect = buffers[feat].weighted_values
+                else:
+                    collect = lambda: [(s.features[feat], 1)
+                                       for e in cloud
+                                       for p, s in enumerate(e.segments)
+                                       if p < 3 and feat in s.features]
+                values, maxima = cached(cache, ('segment', feat), collect, feat)
                 # Iterate over Segments.
                 for pos, seg in enumerate(self.segments):
                     if pos < 3:
@@ -138,7 +331,8 @@ class WordForm:
                             # values across the cloud.
                             seg.entrench_feature(feat, values,
                                                  top_value = segment_top_value,
-                                            max_movement = segment_max_movement)
+                                            max_movement = segment_max_movement,
+                                                 maxima = maxima)
     
     def add_noise(self):
         """Add noise to the non-suffix segments in the WordForm."""
@@ -0,0 +1,355 @@
+"""Run a sweep of simulations on any number of hosts that share a filesystem.
+
+Usage:
+    python work_queue.py submit QUEUE_DIR [--param NAME=V1,V2,... ...]
+                                          [--set NAME=VALUE ...]
+                                          [--replicates N] [--seed N]
+    python work_queue.py work QUEUE_DIR [--lease SECONDS] [--max-tasks N]
+    python work_queue.py local QUEUE_DIR [--workers N] [--lease SECONDS]
+    python work_queue.py status QUEUE_DIR
+    python work_queue.py merge QUEUE_DIR [--output FILE]
+
+`submit` writes one task for every combination of the values given with
+`--param`, times the number of replicates (each with a seed of its own), into a
+directory-based queue.  Any number of workers, on any host that can see the
+directory, then claim tasks and run them.  A worker claims a task by creating
+its claim file, which only one worker can do, and keeps the claim alive by
+touching the file while the task runs.  A claim that hasn't been touched for
+longer than the lease belongs to a worker that died, and its task is claimed
+again by the next worker to come across it.  (The hosts' clocks have to agree
+to well within the lease.)  Results are written to files of their own, and
+`merge` collects them into a single summary, grouped by configuration.
+
+`local` starts several workers on this machine, waits for them to finish the
+queue, and merges the results.
+"""
+
+import argparse, ast, itertools, json, os, socket, subprocess, sys, threading
+from time import perf_counter, sleep, time
+from statistics import mean, median
+import parameters
+import rng
+from log_utils import atomic_write
+from outcomes import devoicing_outcome
+from simulation import configured, parse_setting, run_simulation, run_info
+
+# How long (in seconds) a claim lasts without being renewed.
+default_lease = 60
+# How long (in seconds) an idle worker waits before looking at the queue again.
+poll_interval = 2
+
+def queue_paths(queue_dir):
+    """Return the directories (and the description) that make up a queue."""
+    return {'tasks': os.path.join(queue_dir, 'tasks'),
+            'claims': os.path.join(queue_dir, 'claims'),
+            'results': os.path.join(queue_dir, 'results'),
+            'sweep': os.path.join(queue_dir, 'sweep.json')}
+
+def write_atomically(file_name, data):
+    """Write JSON to a file, so that readers never see it half-written."""
+    with atomic_write(file_name) as out:
+        json.dump(data, out, indent = 1, default = repr)
+
+def read_json(file_name):
+    """Return the contents of a JSON file."""
+    with open(file_name) as json_in:
+        return json.load(json_in)
+
+def parse_values(text):
+    """Parse a NAME=V1,V2,... command-line argument."""
+    name, values = text.split('=', 1)
+    return name, ast.literal_eval('[' + values + ']')
+
+def make_tasks(grid, fixed = None, replicates = 1, seed = None):
+    """Return a task for each combination of values in the grid, replicated.
+
+    Each task gets a seed of its own, derived from the seed given and the
+    task's place in the sweep.
+    """
+    names = sorted(grid)
+    tasks = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        for replicate in range(replicates):
+            settings = dict(fixed or {}, **dict(zip(names, values)))
+            tasks.append({'id': 'task{:06}'.format(len(tasks)),
+                          'parameters': settings,
+                          'replicate': replicate,
+                          'seed': rng.run_seed(seed, len(tasks))})
+    return tasks
+
+def submit(queue_dir, tasks):
+    """Write tasks to the queue (creating it if need be)."""
+    paths = queue_paths(queue_dir)
+    for directory in ('tasks', 'claims', 'results'):
+        os.makedirs(paths[directory], exist_ok = True)
+    for task in tasks:
+        for name in task['parameters']:
+            if not hasattr(parameters, name):
+                raise WorkQueueError('unknown setting: ' + name)
+    for task in tasks:
+        write_atomically(os.path.join(paths['tasks'], task['id'] + '.json'),
+                         task)
+    # Describe the sweep last, once all of its tasks are in place.
+    write_atomically(paths['sweep'], {'tasks': len(tasks),
+                                      'submitted': time()})
+
+def task_ids(queue_dir, kind):
+    """Return the ids of the tasks with files of a kind (tasks, results...)."""
+    directory = queue_paths(queue_dir)[kind]
+    return sorted(f[:-len('.json')] for f in os.listdir(directory)
+                  if f.endswith('.json'))
+
+def claim_file(queue_dir, task_id):
+    """Return the name of a task's claim file."""
+    return os.path.join(queue_paths(queue_dir)['claims'], task_id + '.json')
+
+def result_file(queue_dir, task_id):
+    """Return the name of a task's result file."""
+    return os.path.join(queue_paths(queue_dir)['results'], task_id + '.json')
+
+def claim_expired(file_name, lease):
+    """Return whether a claim hasn't been renewed within the lease."""
+    try:
+        return time() - os.path.getmtime(file_name) > lease
+    except FileNotFoundError:
+        return False
+
+def try_claim(queue_dir, task_id, worker, lease):
+    """Claim a task for the worker; return whether the claim succeeded."""
+    file_name = claim_file(queue_dir, task_id)
+    # A claim whose worker has died is moved aside first, then removed.
+    # Renaming is atomic, so only one of the workers that notice it at the
+    # same time succeeds.  (In the rare race where a fresh claim is moved
+    # aside instead, the task runs twice, with the same seed and so the same
+    # result.)
+    if claim_expired(file_name, lease):
+        expired_file = '{}.expired.{}'.format(file_name, worker)
+        try:
+            os.rename(file_name, expired_file)
+        except FileNotFoundError:
+            return False
+        os.remove(expired_file)
+    # Creating the claim file fails if it already exists, so only one worker
+    # gets each claim.
+    try:
+        fd = os.open(file_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as claim_out:
+        json.dump({'worker': worker, 'claimed': time()}, claim_out)
+    # The task may have been finished between looking and claiming.
+    if os.path.exists(result_file(queue_dir, task_id)):
+        release(queue_dir, task_id)
+        return False
+    return True
+
+def release(queue_dir, task_id):
+    """Give up the claim on a task."""
+    try:
+        os.remove(claim_file(queue_dir, task_id))
+    except FileNotFoundError:
+        pass
+
+def renew_claim(file_name, lease, done):
+    """Keep touching a claim file until the task is done."""
+    while not done.wait(lease / 3):
+        try:
+            os.utime(file_name)
+        except FileNotFoundError:
+            # The claim was taken over; finish anyway, since a task's result
+            # doesn't depend on who runs it.
+            pass
+
+def run_task(task):
+    """Run a task's simulation; return its result."""
+    # The settings are put back afterwards, so that nothing carries over to
+    # the worker's next task.
+    with configured(**dict(task['parameters'], random_seed = task['seed'],
+                           logging_setting = False, telemetry_output = None,
+                           catalogue_file = None)):
+        start = perf_counter()
+        a1, a2 = run_simulation(quiet = True)
+        seconds = perf_counter() - start
+        return {'id': task['id'],
+                'parameters': task['parameters'],
+                'replicate': task['replicate'],
+                'seed': task['seed'],
+                'seconds': seconds,
+                'run_info': dict(run_info),
+                'outcome': devoicing_outcome([a1, a2])}
+
+def work(queue_dir, lease = default_lease, max_tasks = None):
+    """Claim and run tasks until every task in the queue is finished.
+
+    Return the number of tasks this worker ran.
+    """
+    worker = '{}-{}'.format(socket.gethostname(), os.getpid())
+    ran = 0
+    while max_tasks is None or ran < max_tasks:
+        finished = set(task_ids(queue_dir, 'results'))
+        unfinished = [t for t in task_ids(queue_dir, 'tasks')
+                      if not t in finished]
+        if len(unfinished) == 0:
+            break
+        # Take the first task that's free (or whose worker has died).  If
+        # there isn't one, wait for the other workers, in case one of them
+        # dies.
+        task_id = next((t for t in unfinished
+                        if try_claim(queue_dir, t, worker, lease)), None)
+        if task_id is None:
+            sleep(poll_interval)
+            continue
+        task = read_json(os.path.join(queue_paths(queue_dir)['tasks'],
+                                      task_id + '.json'))
+        done = threading.Event()
+        renewer = threading.Thread(target = renew_claim,
+                                   args = (claim_file(queue_dir, task_id),
+                                           lease, done),
+                                   daemon = True)
+        renewer.start()
+        # A task that fails is finished too (with the error as its result),
+        # so that the other workers don't all fail on it in turn.
+        try:
+            result = run_task(task)
+            print('{}: finished {} in {:.1f}s'.format(worker, task_id,
+                                                      result['seconds']))
+        except Exception as error:
+            result = {'id': task_id, 'parameters': task['parameters'],
+                      'replicate': task['replicate'], 'seed': task['seed'],
+                      'error': repr(error)}
+            print('{}: {} failed: {!r}'.format(worker, task_id, error),
+                  file = sys.stderr)
+        finally:
+            done.set()
+            renewer.join()
+        write_atomically(result_file(queue_dir, task_id),
+                         dict(result, worker = worker))
+        release(queue_dir, task_id)
+        ran += 1
+    return ran
+
+def queue_status(queue_dir):
+    """Return the number of tasks that are finished, running, and waiting."""
+    tasks = set(task_ids(queue_dir, 'tasks'))
+    finished = set(task_ids(queue_dir, 'results')) & tasks
+    claimed = set(task_ids(queue_dir, 'claims')) & (tasks - finished)
+    return {'tasks': len(tasks), 'finished': len(finished),
+            'running': len(claimed),
+            'waiting': len(tasks - finished - claimed)}
+
+def config_key(settings):
+    """Return a hashable key for a configuration."""
+    return json.dumps(settings, sort_keys = True, default = repr)
+
+def merge(queue_dir):
+    """Collect the results of the queue's tasks into a summary.
+
+    The summary has an entry for each configuration: its replicates, the
+    proportion of them in which devoicing emerged, their mean score, and the
+    median over replicates of each cloud's VOT median.
+    """
+    results = [read_json(result_file(queue_dir, t))
+               for t in task_ids(queue_dir, 'results')]
+    failed = [r for r in results if 'error' in r]
+    results = [r for r in results if not 'error' in r]
+    groups = dict()
+    for result in results:
+        groups.setdefault(config_key(result['parameters']), []).append(result)
+    configurations = []
+    for key in sorted(groups):
+        group = sorted(groups[key], key = lambda r: r['replicate'])
+        medians = dict()
+        for result in group:
+            for m in result['outcome']['medians']:
+                medians.setdefault((m['agent'], m['lemma'], m['case']),
+                                   []).append(m['vot_median'])
+        configurations.append({
+            'parameters': group[0]['parameters'],
+            'replicates': len(group),
+            'devoiced': mean(r['outcome']['devoiced'] for r in group),
+            'mean_score': mean(r['outcome']['score'] for r in group),
+            'mean_seconds': mean(r['seconds'] for r in group),
+            'medians': [{'agent': a, 'lemma': l, 'case': c,
+                         'vot_median': median(medians[(a, l, c)])}
+                        for a, l, c in sorted(medians)],
+            'tasks': [r['id'] for r in group]})
+    return {'status': queue_status(queue_dir),
+            'configurations': configurations,
+            'failed': [{'id': r['id'], 'parameters': r['parameters'],
+                        'error': r['error']} for r in failed]}
+
+def print_summary(summary):
+    """Print the configurations of a summary, best first."""
+    status = summary['status']
+    print('{finished} of {tasks} tasks finished ({running} running, '
+          '{waiting} waiting)'.format(**status))
+    for c in sorted(summary['configurations'],
+                    key = lambda c: -c['mean_score']):
+        print('score {:.3f}  devoiced {:.0%}  n = {}  {}'.format(
+              c['mean_score'], c['devoiced'], c['replicates'],
+              json.dumps(c['parameters'], sort_keys = True)))
+    for f in summary['failed']:
+        print('{} failed: {}'.format(f['id'], f['error']))
+
+def run_local(queue_dir, workers, lease = default_lease):
+    """Run the queue with several worker processes on this machine."""
+    processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                   'work', queue_dir, '--lease', str(lease)])
+                 for w in range(workers)]
+    for process in processes:
+        process.wait()
+    return merge(queue_dir)
+
+def main():
+    """Submit, work on, or merge a sweep from the command line."""
+    parser = argparse.ArgumentParser(description = 'Run a sweep of '
+                                     'simulations through a queue on a '
+                                     'shared filesystem.')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    submit_parser = commands.add_parser('submit')
+    submit_parser.add_argument('--param', action = 'append', default = [],
+                               type = parse_values,
+                               help = 'values to sweep (NAME=V1,V2,...)')
+    submit_parser.add_argument('--set', action = 'append', default = [],
+                               type = parse_setting,
+                               help = 'override a setting (NAME=VALUE)')
+    submit_parser.add_argument('--replicates', type = int, default = 1)
+    submit_parser.add_argument('--seed', type = int, default = None)
+    work_parser = commands.add_parser('work')
+    work_parser.add_argument('--lease', type = float, default = default_lease)
+    work_parser.add_argument('--max-tasks', type = int, default = None)
+    local_parser = commands.add_parser('local')
+    local_parser.add_argument('--workers', type = int,
+                              default = os.cpu_count() or 1)
+    local_parser.add_argument('--lease', type = float, default = default_lease)
+    local_parser.add_argument('--output', default = None)
+    commands.add_parser('status')
+    merge_parser = commands.add_parser('merge')
+    merge_parser.add_argument('--output', default = None)
+    for command_parser in commands.choices.values():
+        command_parser.add_argument('queue_dir')
+    args = parser.parse_args()
+    if args.command == 'submit':
+        tasks = make_tasks(dict(args.param), dict(args.set), args.replicates,
+                           args.seed)
+        submit(args.queue_dir, tasks)
+        print('Submitted {} tasks'.format(len(tasks)))
+    elif args.command == 'work':
+        work(args.queue_dir, args.lease, args.max_tasks)
+    elif args.command == 'status':
+        print(json.dumps(queue_status(args.queue_dir)))
+    else:
+        if args.command == 'local':
+            summary = run_local(args.queue_dir, args.workers, args.lease)
+        else:
+            summary = merge(args.queue_dir)
+        print_summary(summary)
+        if args.output is not None:
+            write_atomically(args.output, summary)
+
+class WorkQueueError(Exception):
+    """Exception raised when a sweep can't be queued."""
+    pass
+
+if __name__ == '__main__':
+    main()